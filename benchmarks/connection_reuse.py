@@ -0,0 +1,73 @@
+"""Checks that refreshes reuse the keep-alive connections of the shared HTTP client.
+
+Runs the search and wallpaper updater workers against the local mock of derpibooru and its CDN, which are served on
+separate ports like two hosts. Every refresh fetches a page from the API and downloads an image from the CDN.
+Wallpapers are applied through a no-op backend.
+
+Prints the requests sent and connections opened, and exits with 1 unless exactly one connection was opened per host.
+
+Usage: python benchmarks/connection_reuse.py [refreshes]
+"""
+from datetime import datetime
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+from mock_derpibooru import MockDerpibooru
+from refresh_latency import REFRESH_TIMEOUT, install_noop_backend, wait_for
+
+HOSTS = 2  # The API and the CDN
+
+
+def main():
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    mock = MockDerpibooru(image_size=256 * 1024).start()
+
+    from derpiwallpaper.config import get_conf
+    get_conf().derpibooru_json_api_url = mock.api_url
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = 0
+    get_conf().http_cache_size_mb = 0  # Every page has to come from the API
+    backend = install_noop_backend()
+
+    from derpiwallpaper.utils.http import get_http
+    from derpiwallpaper.workers import WorkerManager
+    workers = WorkerManager()
+    updater = workers.wp_updater
+    if not wait_for(lambda: workers.search.current_page_count, REFRESH_TIMEOUT):
+        sys.exit(f"The initial search didn't finish: {workers.search.temporary_error}")
+
+    for _ in range(refreshes):
+        # Without candidates left from the last page, every refresh fetches a new page from the API
+        updater._candidates.clear()
+        applied_before = backend.applied
+        updater.schedule_refresh(datetime.now(), update_ui=False)
+        if not wait_for(lambda: backend.applied > applied_before and not updater.refreshing, REFRESH_TIMEOUT):
+            sys.exit(f"Refresh failed: {updater.temporary_error}")
+
+    stats = get_http().stats
+    mock_stats = mock.stats.snapshot()
+    workers.stop()
+    mock.stop()
+
+    result = {
+        "refreshes": refreshes,
+        "api_requests": mock_stats["api_requests"],
+        "image_requests": mock_stats["image_requests"],
+        "connections_opened": stats.connections_opened,
+        "connections_reused": stats.connections_reused,
+        "one_connection_per_host": stats.connections_opened == HOSTS,
+    }
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["one_connection_per_host"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Runs the native D-Bus wallpaper backends against stand-in desktop services on a private dbus-daemon.
+
+A child process owns the dconf writer, plasmashell and xfconfd bus names and records every call it receives.
+The result contains the time per set_wallpaper call of each backend and the calls the stand-ins saw for the last one.
+
+Usage: python benchmarks/dbus_wallpaper_backends.py [calls]
+"""
+from pathlib import Path
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+STAND_IN_SERVICES = ["ca.desrt.dconf", "org.kde.plasmashell", "org.xfce.Xfconf", "derpiwallpaper.StandIn"]
+XFCE_CHANNEL = """<?xml version="1.0" encoding="UTF-8"?>
+<channel name="xfce4-desktop" version="1.0">
+  <property name="backdrop" type="empty">
+    <property name="screen0" type="empty">
+      <property name="monitorHDMI-1" type="empty">
+        <property name="workspace0" type="empty">
+          <property name="last-image" type="string" value=""/>
+        </property>
+        <property name="workspace1" type="empty">
+          <property name="last-image" type="string" value=""/>
+        </property>
+      </property>
+      <property name="monitoreDP-1" type="empty">
+        <property name="workspace0" type="empty">
+          <property name="image-style" type="int" value="5"/>
+          <property name="last-image" type="string" value=""/>
+        </property>
+      </property>
+    </property>
+  </property>
+</channel>
+"""
+
+
+def run_stand_in():
+    """Answers the wallpaper calls of the backends and reports them through derpiwallpaper.StandIn.Calls."""
+    from PySide6.QtCore import QCoreApplication
+    from PySide6.QtDBus import QDBusConnection, QDBusMessage, QDBusVirtualObject
+
+    app = QCoreApplication(sys.argv)
+    calls: list[list] = []
+
+    class StandIn(QDBusVirtualObject):
+        def introspect(self, path):
+            return ""
+
+        def handleMessage(self, message, connection):
+            if message.type() != QDBusMessage.MessageType.MethodCallMessage:
+                return False
+            args = message.arguments()
+            reply = None
+            if message.member() == "Calls":
+                reply = json.dumps(calls)
+                calls.clear()
+            elif message.member() == "Change":
+                reply = "tag"
+                args = [bytes(args[0]).hex()]
+            elif message.member() == "SetProperty":
+                args = [*args[:2], args[2].variant()]
+            if message.member() not in ("Calls", "Introspect"):
+                calls.append([message.interface(), message.member(), *[str(arg) for arg in args]])
+            connection.send(message.createReply() if reply is None else message.createReply(reply))
+            return True
+
+    bus = QDBusConnection.sessionBus()
+    stand_in = StandIn()
+    for path in ["/ca/desrt/dconf/Writer/user", "/PlasmaShell", "/org/xfce/Xfconf", "/StandIn"]:
+        bus.registerVirtualObject(path, stand_in)
+    for service in STAND_IN_SERVICES:
+        bus.registerService(service)
+    print("ready", flush=True)
+    app.exec()
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Start a private session bus, the real desktop is never touched
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address"], stdout=subprocess.PIPE, text=True)
+    assert daemon.stdout
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = daemon.stdout.readline().strip()
+    stand_in = subprocess.Popen([sys.executable, __file__, "--stand-in"], stdout=subprocess.PIPE, text=True)
+    assert stand_in.stdout
+    stand_in.stdout.readline()
+
+    try:
+        from PySide6.QtDBus import QDBusConnection, QDBusInterface
+        from derpiwallpaper.utils.set_wallpaper import get_wallpaper_backend, invalidate_wallpaper_backend, set_wallpaper
+
+        stand_in_calls = QDBusInterface("derpiwallpaper.StandIn", "/StandIn", "derpiwallpaper.StandIn", QDBusConnection.sessionBus())
+        image_path = Path(os.environ["XDG_CONFIG_HOME"]) / "derpibooru_0.png"
+        xfce_channel_file = Path(os.environ["XDG_CONFIG_HOME"]) / "xfce4" / "xfconf" / "xfce-perchannel-xml" / "xfce4-desktop.xml"
+        xfce_channel_file.parent.mkdir(parents=True)
+        xfce_channel_file.write_text(XFCE_CHANNEL)
+
+        result = {}
+        for de in ["GNOME", "KDE", "XFCE"]:
+            os.environ["XDG_CURRENT_DESKTOP"] = de
+            invalidate_wallpaper_backend()
+            backend = get_wallpaper_backend().name
+
+            start = time.perf_counter()
+            for _ in range(calls):
+                set_wallpaper(image_path)
+            ms_per_call = (time.perf_counter() - start) / calls * 1000
+
+            received = json.loads(stand_in_calls.call("Calls").arguments()[0])
+            result[de.lower()] = {
+                "backend": backend,
+                "ms_per_call": round(ms_per_call, 3),
+                "calls_per_set": len(received) / calls,
+                "last_set": received[-int(len(received) / calls):],
+            }
+        print(json.dumps({"calls": calls, "backends": result}, indent=2))
+    finally:
+        stand_in.terminate()
+        daemon.terminate()
+
+
+if __name__ == "__main__":
+    if "--stand-in" in sys.argv:
+        run_stand_in()
+    else:
+        main()
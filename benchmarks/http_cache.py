@@ -0,0 +1,117 @@
+"""Measures how many identical API requests the response cache answers, for different caching headers of the API.
+
+A local stub of the search API answers after a fixed latency, either without caching headers (the fallback TTL
+applies), with an ETag that has to be revalidated on every request, or with no-store. Every page of a search is
+requested several times with and without the cache.
+
+Prints the requests that reached the stub, the response bodies it sent, the mean time per request and the cache stats.
+
+Usage: python benchmarks/http_cache.py [rounds] [api_latency_ms]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+PAGES = 5
+API_LATENCY = 0.05  # Seconds the stub waits before answering
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mode = ""
+    requests = 0
+    body_bytes = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(API_LATENCY)
+        port = self.server.server_address[1]
+        images = [{"id": image_id, "view_url": f"http://127.0.0.1:{port}/img/{image_id}.png", "format": "png", "tags": ["safe"] * 20} for image_id in range(1, 51)]
+        body = json.dumps({"total": 10_000, "images": images}).encode()
+        etag = f'"{hashlib.sha1(self.path.encode()).hexdigest()}"'
+
+        if self.mode == "etag" and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            body = b""
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        if self.mode == "etag":
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "max-age=0, private, must-revalidate")
+        elif self.mode == "no_store":
+            self.send_header("Cache-Control", "no-store")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        type(self).body_bytes += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_scenario(mode: str, cache_mb: int, rounds: int, api_url: str) -> dict:
+    from derpiwallpaper.config import get_conf
+    from derpiwallpaper.utils import check_response, http
+
+    StubApiHandler.mode = mode
+    StubApiHandler.requests = StubApiHandler.body_bytes = 0
+
+    # Fresh client and an empty cache per scenario
+    get_conf().http_cache_size_mb = cache_mb
+    if http._HTTP:
+        http._HTTP.close()
+    http._HTTP = None
+    (get_conf().appdir / "http_cache.sqlite3").unlink(missing_ok=True)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for page in range(1, PAGES + 1):
+            response = http.get_http().get(api_url, params={"q": "safe", "per_page": 50, "page": page})
+            check_response(response)
+    seconds = time.perf_counter() - started
+
+    return {
+        "requests_sent": StubApiHandler.requests,
+        "body_kib_sent": round(StubApiHandler.body_bytes / 1024, 1),
+        "mean_ms": round(seconds / (rounds * PAGES) * 1000, 1),
+        "cache": str(http.get_http().cache or "disabled"),
+    }
+
+
+def main():
+    global API_LATENCY
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    API_LATENCY = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    from derpiwallpaper.config import get_conf
+    get_conf().derpibooru_json_api_url = f"http://127.0.0.1:{server.server_port}/"
+    # Keep the rate limiter out of the measurement
+    get_conf().api_rate_limit_per_second = 1000.0
+    get_conf().api_rate_limit_burst = 1000
+    api_url = get_conf().derpibooru_json_api_url + "search/images"
+
+    result = {}
+    for mode in ("no_headers", "etag", "no_store"):
+        result[mode] = {
+            "uncached": run_scenario(mode, 0, rounds, api_url),
+            "cached": run_scenario(mode, 16, rounds, api_url),
+        }
+    server.shutdown()
+    print(json.dumps({"rounds": rounds, "pages": PAGES, "api_latency_ms": API_LATENCY * 1000} | result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
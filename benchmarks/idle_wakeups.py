@@ -0,0 +1,70 @@
+"""Counts worker wakeups and CPU time while DerpiWallpaper sits idle.
+
+Runs the worker manager against a local stub of the derpibooru search API with an isolated config dir,
+waits until the startup work is done and then measures a fixed idle window.
+
+Usage: python benchmarks/idle_wakeups.py [window_seconds]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({"total": 0, "images": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    window = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    from derpiwallpaper.config import get_conf
+    get_conf().derpibooru_json_api_url = f"http://127.0.0.1:{server.server_port}/"
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().enable_auto_refresh = False
+
+    from derpiwallpaper.workers import WorkerManager
+    workers = WorkerManager()
+    time.sleep(1)  # Let startup work settle
+
+    worker_threads = {"search": workers.search, "wp_updater": workers.wp_updater, "cleanup": workers.cleanup}
+    wakeups_before = {name: worker.wakeups for name, worker in worker_threads.items()}
+    scheduler_wakeups_before = workers.scheduler.wakeups
+    cpu_before = time.process_time()
+
+    time.sleep(window)
+
+    result = {
+        "window_seconds": window,
+        "cpu_seconds": round(time.process_time() - cpu_before, 4),
+        "scheduler_wakeups": workers.scheduler.wakeups - scheduler_wakeups_before,
+        "worker_wakeups": {name: worker.wakeups - wakeups_before[name] for name, worker in worker_threads.items()},
+    }
+    workers.stop()
+    server.shutdown()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
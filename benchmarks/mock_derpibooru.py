@@ -0,0 +1,161 @@
+"""Local mock of the derpibooru search API and its image CDN for the benchmarks.
+
+The API and the CDN are served on separate ports, so the app treats them as different hosts just like derpibooru.org
+and derpicdn.net. Latency, bandwidth, image size and error rate can be configured, all served bytes are counted.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+import hashlib
+import json
+import random
+import time
+
+IMAGE_WIDTH = 3840
+IMAGE_HEIGHT = 2160
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class MockStats:
+    """Thread-safe counters of the requests the mock served."""
+    api_requests: int = 0
+    image_requests: int = 0
+    errors: int = 0
+    bytes_sent: int = 0
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    def count_request(self, kind: str, error: bool = False):
+        with self._lock:
+            if kind == "api":
+                self.api_requests += 1
+            else:
+                self.image_requests += 1
+            self.errors += error
+
+    def count_bytes(self, sent: int):
+        with self._lock:
+            self.bytes_sent += sent
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "api_requests": self.api_requests,
+                "image_requests": self.image_requests,
+                "errors": self.errors,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class MockDerpibooru:
+    """Serves /api/v1/json/search/images and /img/<id>.png on two local ports until stopped.
+
+    latency: seconds waited before each response is sent
+    bandwidth: bytes per second each response body is throttled to, 0 for unlimited
+    image_size: size of every served image in bytes
+    error_rate: fraction of requests answered with HTTP 503
+    total: number of images every search matches
+    """
+
+    def __init__(self, latency: float = 0.0, bandwidth: int = 0, image_size: int = 1024 * 1024,
+                 error_rate: float = 0.0, total: int = 10_000, seed: int | None = None) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.image_size = image_size
+        self.error_rate = error_rate
+        self.total = total
+        self.stats = MockStats()
+        self._random = random.Random(seed)
+        self._random_lock = Lock()
+        self._image = b"\0" * image_size
+        self._image_hash = hashlib.sha512(self._image).hexdigest()
+        self._api = ThreadingHTTPServer(("127.0.0.1", 0), self._handler("api"))
+        self._cdn = ThreadingHTTPServer(("127.0.0.1", 0), self._handler("cdn"))
+
+    @property
+    def api_url(self) -> str:
+        """Value for the derpibooru_json_api_url setting."""
+        return f"http://127.0.0.1:{self._api.server_port}/api/v1/json/"
+
+    @property
+    def cdn_url(self) -> str:
+        return f"http://127.0.0.1:{self._cdn.server_port}/img/"
+
+    def start(self) -> MockDerpibooru:
+        for server in (self._api, self._cdn):
+            Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        for server in (self._api, self._cdn):
+            server.shutdown()
+            server.server_close()
+
+    def _should_fail(self) -> bool:
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    def _search_page(self, query: dict[str, list[str]]) -> bytes:
+        per_page = int(query.get("per_page", ["50"])[0])
+        page = int(query.get("page", ["1"])[0])
+        first = (page - 1) * per_page
+        images = []
+        # Ids count down from the total, like a search sorted by id with the newest images first
+        for position in range(first, min(first + per_page, self.total)):
+            image_id = self.total - position
+            view_url = f"{self.cdn_url}view/{image_id}.png"
+            images.append({
+                "id": image_id,
+                "format": "png",
+                "width": IMAGE_WIDTH,
+                "height": IMAGE_HEIGHT,
+                "view_url": view_url,
+                "sha512_hash": self._image_hash,
+                "representations": {name: f"{self.cdn_url}{name}/{image_id}.png" for name in ("medium", "large", "tall")} | {"full": view_url},
+            })
+        return json.dumps({"total": self.total, "images": images}).encode()
+
+    def _handler(self, kind: str) -> type[BaseHTTPRequestHandler]:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                url = urlsplit(self.path)
+                if mock._should_fail():
+                    status, content_type, body = 503, "application/json", b'{"error": "Service unavailable"}'
+                elif kind == "api" and url.path == "/api/v1/json/search/images":
+                    status, content_type, body = 200, "application/json", mock._search_page(parse_qs(url.query))
+                elif kind == "cdn" and url.path.startswith("/img/"):
+                    status, content_type, body = 200, "image/png", mock._image
+                else:
+                    status, content_type, body = 404, "application/json", b'{"error": "Not found"}'
+
+                # Counted before anything is sent, so the client never receives data that isn't counted yet. Counting
+                # once the handler is done raced with benchmarks that take their snapshot right after the last refresh.
+                mock.stats.count_request(kind, error=status >= 500)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                for start in range(0, len(body), CHUNK_SIZE):
+                    chunk = body[start:start + CHUNK_SIZE]
+                    mock.stats.count_bytes(len(chunk))
+                    try:
+                        self.wfile.write(chunk)
+                    except (BrokenPipeError, ConnectionResetError):
+                        mock.stats.count_bytes(-len(chunk))
+                        return
+                    if mock.bandwidth:
+                        time.sleep(len(chunk) / mock.bandwidth)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
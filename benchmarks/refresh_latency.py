@@ -0,0 +1,160 @@
+"""Measures the end-to-end time from a refresh request until the wallpaper is set.
+
+Runs the search and wallpaper updater workers headlessly against a local mock of derpibooru and its CDN with an
+isolated config dir. Wallpapers are applied through a no-op backend, so the real desktop is never touched.
+The configured rate limits stay in place, they're part of what a user waits for.
+
+Usage: python benchmarks/refresh_latency.py [--refreshes N] [--latency-ms MS] [--bandwidth-kib KIB] [--image-kib KIB]
+                                            [--error-rate RATE] [--prefetch-depth N] [--output FILE]
+"""
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+from mock_derpibooru import MockDerpibooru
+
+REFRESH_TIMEOUT = 120  # Seconds after which a refresh counts as hung
+
+
+def percentile(values: list[float], percent: float) -> float | None:
+    """Nearest-rank percentile, None without values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def peak_rss_mib() -> float | None:
+    """Peak resident set size of the whole process (including the mock servers), None if unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def install_noop_backend():
+    """Makes set_wallpaper() use a backend that only counts its calls."""
+    from derpiwallpaper.utils import set_wallpaper as set_wallpaper_module
+
+    class NoopBackend(set_wallpaper_module.WallpaperBackend):
+        name = "noop"
+        applied = 0
+        _lock = Lock()
+
+        def apply(self, image_path):
+            with self._lock:
+                NoopBackend.applied += 1
+
+    backend = NoopBackend()
+    set_wallpaper_module._resolve_backend = lambda: backend
+    return backend
+
+
+def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--refreshes", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50, help="delay before every mock response")
+    parser.add_argument("--bandwidth-kib", type=int, default=10 * 1024, help="per response bandwidth in KiB/s, 0 for unlimited")
+    parser.add_argument("--image-kib", type=int, default=2 * 1024, help="size of every served image")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 503")
+    parser.add_argument("--prefetch-depth", type=int, default=0, help="images downloaded ahead of time, 0 measures cold refreshes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    mock = MockDerpibooru(
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_kib * 1024,
+        image_size=args.image_kib * 1024,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    ).start()
+
+    random.seed(args.seed)  # Makes the app pick the same images in every run
+
+    from derpiwallpaper.config import PACKAGE_VERSION, get_conf
+    get_conf().derpibooru_json_api_url = mock.api_url
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = args.prefetch_depth
+    backend = install_noop_backend()
+
+    from derpiwallpaper.workers import WorkerManager
+    workers = WorkerManager()
+    updater = workers.wp_updater
+    if not wait_for(lambda: workers.search.current_page_count, REFRESH_TIMEOUT):
+        sys.exit(f"The initial search didn't finish: {workers.search.temporary_error}")
+
+    latencies: list[float] = []
+    failures = 0
+    stats_before = mock.stats.snapshot()
+    for _ in range(args.refreshes):
+        # Like the auto refresh interval, give the prefetch queue time to fill up between refreshes. A failed prefetch is
+        # only retried after the next refresh.
+        wait_for(lambda: len(updater.get_prefetched_paths()) >= args.prefetch_depth or updater._prefetch_failed, REFRESH_TIMEOUT)
+
+        applied_before = backend.applied
+        started = time.perf_counter()
+        updater.schedule_refresh(datetime.now(), update_ui=False)
+        done = wait_for(lambda: not updater.refreshing and not updater.get_next_refresh_time(), REFRESH_TIMEOUT)
+        if done and backend.applied > applied_before:
+            latencies.append(time.perf_counter() - started)
+        else:
+            failures += 1
+    stats = {key: value - stats_before[key] for key, value in mock.stats.snapshot().items()}
+
+    def ms(seconds: float | None) -> float | None:
+        return None if seconds is None else round(seconds * 1000, 1)
+
+    result = {
+        "version": PACKAGE_VERSION,
+        "parameters": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "refreshes": args.refreshes,
+        "failed_refreshes": failures,
+        "time_to_wallpaper_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(max(latencies, default=None)),
+        },
+        "api_calls_per_refresh": round(stats["api_requests"] / args.refreshes, 2),
+        "image_downloads_per_refresh": round(stats["image_requests"] / args.refreshes, 2),
+        "bytes_transferred": stats["bytes_sent"],
+        "server_errors": stats["errors"],
+        "peak_rss_mib": peak_rss_mib(),
+    }
+    workers.stop()
+    mock.stop()
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measures how hard the search worker retries while searches fail.
+
+A local server fails every search in one of three ways:
+- invalid_query: HTTP 400, like derpibooru does for a search string it can't parse
+- server_error: HTTP 503, like an overloaded or down derpibooru
+- unreachable: no server is listening at all
+
+Prints the number of search requests, worker wakeups, UI updates and CPU time per scenario.
+
+Usage: python benchmarks/search_retries.py [seconds]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+
+class FailingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    scenario = ""
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        status, body = (400, {"error": "Unexpected token"}) if self.scenario == "invalid_query" else (503, {})
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_scenario(scenario: str, seconds: float) -> dict:
+    from derpiwallpaper.config import get_conf
+    from derpiwallpaper.utils import http
+    from derpiwallpaper.workers import UiUpdates, WorkerManager
+
+    class CountingUiUpdates(UiUpdates):
+        search_updates = 0
+
+        def mark_dirty(self, *fields: str):
+            if "search" in fields:
+                self.search_updates += 1
+
+    server = None
+    if scenario == "unreachable":
+        api_url = f"http://127.0.0.1:{free_port()}/"
+    else:
+        FailingHandler.scenario = scenario
+        FailingHandler.requests = 0
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FailingHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        api_url = f"http://127.0.0.1:{server.server_port}/"
+
+    # Fresh HTTP client so rate limits and circuit breakers of the previous scenario don't carry over
+    get_conf().derpibooru_json_api_url = api_url
+    http._HTTP = None
+
+    ui_updates = CountingUiUpdates()
+    cpu_start = time.process_time()
+    workers = WorkerManager(ui_updates=ui_updates)
+    time.sleep(seconds)
+    result = {
+        "search_requests": http.get_http().stats.requests,
+        "wakeups": workers.search.wakeups,
+        "ui_updates": ui_updates.search_updates,
+        "cpu_ms": round((time.process_time() - cpu_start) * 1000, 1),
+        "error": workers.search.temporary_error,
+        "circuit_breakers": str(http.get_http().circuit_breakers),
+    }
+    workers.stop()
+    if server:
+        server.shutdown()
+    return result
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+
+    from derpiwallpaper.config import get_conf
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = 0
+
+    result = {scenario: run_scenario(scenario, seconds) for scenario in ("invalid_query", "server_error", "unreachable")}
+    print(json.dumps({"seconds": seconds} | result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Measures the searches sent while a search string is typed into the search field.
+
+Runs the UI offscreen against a local stub of the derpibooru API that answers after api_latency_ms with a total that
+identifies the query. The query is typed one character at a time, then erased back to a word typed before.
+
+Prints the search requests sent while typing and while erasing, and whether the shown result count belongs to the final
+search string.
+
+Usage: python benchmarks/search_typing.py [keystroke_interval_ms] [api_latency_ms]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+import json
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+os.environ["QT_QPA_PLATFORM"] = "offscreen"
+
+QUERY = "safe, pony, score.gt:100"
+ERASE_TO = "safe, pony"
+API_LATENCY = 0.3  # Seconds the stub waits before answering
+
+
+def total_for(query: str) -> int:
+    """Result count the stub reports for a query, different for every query."""
+    return zlib.crc32(query.encode()) % 100_000 + 1
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    queries: list[str] = []
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query).get("q", [""])[0]
+        type(self).queries.append(query)
+        time.sleep(API_LATENCY)
+        body = json.dumps({"total": total_for(query), "images": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    global API_LATENCY
+    keystroke_interval = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.12
+    API_LATENCY = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.3
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    from PySide6.QtWidgets import QLineEdit
+    from derpiwallpaper.config import get_conf
+    from derpiwallpaper.ui import DerpiWallpaperApp, DerpiWallpaperUI
+    from derpiwallpaper.ui_updates import UiUpdateBus
+    from derpiwallpaper.workers import WorkerManager
+
+    get_conf().derpibooru_json_api_url = f"http://127.0.0.1:{server.server_port}/"
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = 0
+    get_conf().search_string = ""
+
+    app = DerpiWallpaperApp()
+    workers = WorkerManager(ui_updates=UiUpdateBus())
+    widget = DerpiWallpaperUI()
+    widget.show()
+    search_input = widget.findChild(QLineEdit)
+    assert search_input
+
+    def run_for(seconds: float):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.005)
+
+    def settle():
+        """Processes events until no search was sent for a while."""
+        sent = -1
+        while sent != len(StubApiHandler.queries):
+            sent = len(StubApiHandler.queries)
+            run_for(1 + API_LATENCY * 2)
+
+    def type_text(text: str):
+        for character in text:
+            search_input.insert(character)
+            run_for(keystroke_interval)
+
+    def erase_to(text: str):
+        while search_input.text() != text:
+            search_input.backspace()
+            run_for(keystroke_interval)
+
+    settle()
+    StubApiHandler.queries.clear()
+
+    # Type the word that's erased back to later first, so it was searched for before
+    type_text(ERASE_TO)
+    settle()
+    type_text(QUERY[len(ERASE_TO):])
+    settle()
+    typing_queries = list(StubApiHandler.queries)
+    typed_correct = workers.search.current_result_count == total_for(QUERY)
+
+    StubApiHandler.queries.clear()
+    erase_to(ERASE_TO)
+    settle()
+    erasing_queries = list(StubApiHandler.queries)
+    erased_correct = workers.search.current_result_count == total_for(ERASE_TO)
+
+    workers.stop()
+    server.shutdown()
+    print(json.dumps({
+        "keystroke_interval_ms": keystroke_interval * 1000,
+        "api_latency_ms": API_LATENCY * 1000,
+        "keystrokes_typed": len(QUERY),
+        "search_requests_typing": len(typing_queries),
+        "result_count_matches_typed_query": typed_correct,
+        "keystrokes_erased": len(QUERY) - len(ERASE_TO),
+        "search_requests_erasing": len(erasing_queries),
+        "result_count_matches_erased_query": erased_correct,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
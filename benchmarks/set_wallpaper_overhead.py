@@ -0,0 +1,76 @@
+"""Measures the per call overhead of set_wallpaper for each Linux wallpaper backend.
+
+Every backend runs against stub executables (gsettings, qdbus, xfconf-query and ps) that exit immediately, so the
+result is the overhead of detecting the desktop and spawning the setter, not the time the desktop takes to apply it.
+"cold" resolves the backend on every call like before it was cached, "cached" reuses it.
+
+Usage: python benchmarks/set_wallpaper_overhead.py [calls]
+"""
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+STUB_EXECUTABLES = {
+    "gsettings": "exit 0",
+    "qdbus": "exit 0",
+    "xfconf-query": "exit 0",
+    "ps": "echo plasmashell",  # Only reached by the process table fallback
+}
+
+SESSIONS = {
+    "gnome": {"XDG_CURRENT_DESKTOP": "GNOME"},
+    "kde": {"XDG_CURRENT_DESKTOP": "KDE"},
+    "xfce": {"XDG_CURRENT_DESKTOP": "XFCE"},
+    "kde (ps fallback)": {},
+}
+
+
+def create_stubs() -> Path:
+    stub_dir = Path(tempfile.mkdtemp(prefix="derpiwallpaper-stubs-"))
+    for name, body in STUB_EXECUTABLES.items():
+        stub = stub_dir / name
+        stub.write_text(f"#!/bin/sh\n{body}\n")
+        stub.chmod(0o755)
+    return stub_dir
+
+
+def measure(calls: int, image_path: Path, cold: bool) -> float:
+    from derpiwallpaper.utils.set_wallpaper import invalidate_wallpaper_backend, set_wallpaper
+
+    invalidate_wallpaper_backend()
+    start = time.perf_counter()
+    for _ in range(calls):
+        if cold:
+            invalidate_wallpaper_backend()
+        set_wallpaper(image_path)
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    stub_dir = create_stubs()
+    os.environ["PATH"] = os.pathsep.join([str(stub_dir), "/usr/bin", "/bin"])
+    image_path = stub_dir / "derpibooru_0.png"
+
+    result = {}
+    for session, env in SESSIONS.items():
+        for var in ("XDG_CURRENT_DESKTOP", "DESKTOP_SESSION", "KDE_FULL_SESSION", "GNOME_DESKTOP_SESSION_ID"):
+            os.environ.pop(var, None)
+        os.environ.update(env)
+
+        result[session] = {
+            "cold_ms_per_call": round(measure(calls, image_path, cold=True), 3),
+            "cached_ms_per_call": round(measure(calls, image_path, cold=False), 3),
+        }
+    print(json.dumps({"calls": calls, "backends": result}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Checks that stopping the workers stays within the shutdown deadline while network I/O is stuck.
+
+A local server stalls on purpose in three scenarios:
+- stalled_search: the search API accepts the request but never answers
+- stalled_download: the image CDN sends the first chunk of an image and then stalls
+- rate_limited: the search API answers with HTTP 429 and asks for a long pause before retrying
+
+Prints the time WorkerManager.stop() took per scenario and exits with 1 if any of them exceeded the deadline.
+
+Usage: python benchmarks/shutdown_deadline.py
+"""
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Event, Thread
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+
+SLACK = 0.1  # Seconds stop() may take beyond the deadline, e.g. for printing
+IMAGE_SIZE = 16 * 1024 * 1024
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    scenario = ""
+    stalled = Event()  # Set once a request is stuck
+    release = Event()  # Lets stuck requests finish
+
+    def do_GET(self):
+        port = self.server.server_address[1]
+        if self.path.startswith("/img/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(IMAGE_SIZE))
+            self.end_headers()
+            self.wfile.write(b"\0" * 64 * 1024)
+            self.wfile.flush()
+            self.stalled.set()
+            self.release.wait()
+            return
+
+        if self.scenario == "stalled_search":
+            self.stalled.set()
+            self.release.wait()
+            return
+        if self.scenario == "rate_limited":
+            self.send_response(429)
+            self.send_header("Retry-After", "60")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            self.stalled.set()
+            return
+
+        images = [{"id": image_id, "view_url": f"http://127.0.0.1:{port}/img/{image_id}.png", "format": "png"} for image_id in range(1, 51)]
+        body = json.dumps({"total": 50, "images": images}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_scenario(scenario: str) -> dict:
+    from derpiwallpaper.config import SHUTDOWN_TIMEOUT
+    from derpiwallpaper.workers import WorkerManager
+
+    StallingHandler.scenario = scenario
+    StallingHandler.stalled.clear()
+    StallingHandler.release.clear()
+
+    workers = WorkerManager()
+    if scenario == "stalled_download":
+        workers.search.ready.wait(10)
+        workers.wp_updater.schedule_refresh(datetime.now(), update_ui=False)
+    if not StallingHandler.stalled.wait(10):
+        sys.exit(f"{scenario}: the workers never got stuck")
+    time.sleep(0.2)  # Let the worker block on the socket or the rate limiter
+
+    threads = [workers.search, workers.wp_updater, workers.cleanup]
+    started = time.perf_counter()
+    workers.stop()
+    stop_seconds = time.perf_counter() - started
+    abandoned = [thread.name for thread in threads if thread.is_alive()]
+
+    # Let abandoned workers finish before the next scenario starts
+    StallingHandler.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    return {
+        "stop_ms": round(stop_seconds * 1000, 1),
+        "deadline_ms": SHUTDOWN_TIMEOUT * 1000,
+        "within_deadline": stop_seconds <= SHUTDOWN_TIMEOUT + SLACK,
+        "abandoned_workers": abandoned,
+    }
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    from derpiwallpaper.config import get_conf
+    get_conf().derpibooru_json_api_url = f"http://127.0.0.1:{server.server_port}/"
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = 0
+    get_conf().http_cache_size_mb = 0  # Every scenario has to reach the stalling server
+
+    # The rate limiter pause outlives the scenario, so it runs last
+    result = {scenario: run_scenario(scenario) for scenario in ("stalled_search", "stalled_download", "rate_limited")}
+    server.shutdown()
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if all(scenario["within_deadline"] for scenario in result.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Compares startup time and memory of the GUI and the headless mode.
+
+Every run starts a fresh interpreter with an isolated config dir that talks to a local stub of the derpibooru API,
+which answers after api_latency_ms. The GUI runs offscreen. A run counts as started once the workers are running and,
+for the GUI, the window was shown.
+
+Usage: python benchmarks/startup.py [runs] [api_latency_ms]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+API_LATENCY = 0.0  # Seconds the stub waits before answering
+
+ROOT = Path(__file__).parent.parent
+
+# Runs in the child process, mirrors what __main__ does for each mode
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+from derpiwallpaper.config import get_conf
+get_conf().derpibooru_json_api_url = sys.argv[2]  # Not a configurable attribute, so it can't be set in config.ini
+if sys.argv[1] == "gui":
+    from derpiwallpaper.ui import DerpiWallpaperApp, DerpiWallpaperUI
+    from derpiwallpaper.ui_updates import UiUpdateBus
+    from derpiwallpaper.workers import WorkerManager
+    app = DerpiWallpaperApp()
+    workers = WorkerManager(ui_updates=UiUpdateBus())
+    widget = DerpiWallpaperUI()
+    widget.show()
+    app.processEvents()
+else:
+    from derpiwallpaper.workers import WorkerManager
+    workers = WorkerManager()
+startup_seconds = time.perf_counter() - start
+
+rss_kib = None
+try:
+    with open("/proc/self/status") as status:
+        rss_kib = next(int(line.split()[1]) for line in status if line.startswith("VmRSS:"))
+except OSError:
+    import resource
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+
+print(json.dumps({
+    "startup_seconds": startup_seconds,
+    "rss_kib": rss_kib,
+    "qt_modules": sorted(name for name in sys.modules if name.startswith("PySide6.Qt")),
+}), flush=True)
+workers.stop()
+"""
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(API_LATENCY)
+        body = json.dumps({"total": 0, "images": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_once(mode: str, api_url: str, env: dict[str, str]) -> dict:
+    # stderr goes to a file so a chatty child can't block on a full pipe while stdout is read
+    with tempfile.TemporaryFile("w+") as stderr:
+        started = time.perf_counter()
+        child = subprocess.Popen([sys.executable, "-c", CHILD, mode, api_url], cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        assert child.stdout
+        result: dict = {}
+        for line in child.stdout:
+            if line.startswith("{"):
+                # Includes the interpreter startup, unlike startup_seconds which the child measures itself
+                result = json.loads(line) | {"process_seconds": time.perf_counter() - started}
+        child.wait()
+        if not result:
+            stderr.seek(0)
+            sys.exit(f"The {mode} child failed with exit code {child.returncode}:\n{stderr.read()}")
+    return result
+
+
+def main():
+    global API_LATENCY
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    API_LATENCY = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    # Point a fresh config at the stub before the first run
+    env = os.environ | {
+        "XDG_CONFIG_HOME": tempfile.mkdtemp(prefix="derpiwallpaper-bench-"),
+        "QT_QPA_PLATFORM": "offscreen",
+        "PYTHONPATH": str(ROOT),
+    }
+    config_dir = Path(env["XDG_CONFIG_HOME"]) / "DerpiWallpaper"
+    config_dir.mkdir(parents=True)
+    (config_dir / "config.ini").write_text(
+        "[DerpiWallpaper]\n"
+        f"wallpaper_folder = {Path(env['XDG_CONFIG_HOME']) / 'wallpapers'}\n"
+        "enable_auto_refresh = False\n"
+    )
+
+    result = {}
+    for mode in ("gui", "headless"):
+        samples = [run_once(mode, f"http://127.0.0.1:{server.server_port}/", env) for _ in range(runs)]
+        result[mode] = {
+            "process_ms": round(statistics.median(sample["process_seconds"] for sample in samples) * 1000, 1),
+            "startup_ms": round(statistics.median(sample["startup_seconds"] for sample in samples) * 1000, 1),
+            "rss_mib": round(statistics.median(sample["rss_kib"] for sample in samples) / 1024, 1),
+            "qt_modules": samples[-1]["qt_modules"],
+        }
+    server.shutdown()
+    print(json.dumps({"runs": runs, "api_latency_ms": API_LATENCY * 1000} | result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Measures the GUI-thread CPU time spent per wallpaper refresh while the window is visible.
+
+Runs the full UI offscreen against a local stub of the derpibooru API and CDN. Wallpapers are "set" through a stub
+xfconf-query, so the real desktop is never touched. Each refresh downloads a fresh image, so the progress bar runs
+through all of its steps.
+
+Usage: python benchmarks/ui_updates.py [refreshes]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="derpiwallpaper-bench-")
+os.environ["QT_QPA_PLATFORM"] = "offscreen"
+os.environ["XDG_CURRENT_DESKTOP"] = "XFCE"
+os.environ.pop("DBUS_SESSION_BUS_ADDRESS", None)
+
+IMAGE_SIZE = 4 * 1024 * 1024
+IMAGE_IDS = itertools.count(1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/img/"):
+            body = b"\0" * IMAGE_SIZE
+            content_type = "image/png"
+        else:
+            port = self.server.server_address[1]
+            images = [{"id": image_id, "view_url": f"http://127.0.0.1:{port}/img/{image_id}.png", "format": "png"} for image_id in itertools.islice(IMAGE_IDS, 50)]
+            body = json.dumps({"total": 1_000_000, "images": images}).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_stub_setter() -> Path:
+    stub_dir = Path(tempfile.mkdtemp(prefix="derpiwallpaper-stubs-"))
+    stub = stub_dir / "xfconf-query"
+    stub.write_text("#!/bin/sh\nexit 0\n")
+    stub.chmod(0o755)
+    return stub_dir
+
+
+def main():
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["PATH"] = os.pathsep.join([str(create_stub_setter()), os.environ.get("PATH", "")])
+
+    from derpiwallpaper.config import get_conf
+    get_conf().derpibooru_json_api_url = f"http://127.0.0.1:{server.server_port}/"
+    get_conf().wallpaper_folder = Path(os.environ["XDG_CONFIG_HOME"]) / "wallpapers"
+    get_conf().wallpaper_folder.mkdir()
+    get_conf().enable_auto_refresh = False
+    get_conf().prefetch_depth = 0  # Every refresh downloads while the user waits
+    get_conf().cdn_rate_limit_per_second = 1000.0
+    get_conf().api_rate_limit_per_second = 1000.0
+
+    from PySide6.QtCore import QTimer
+    from derpiwallpaper.ui import DerpiWallpaperApp, DerpiWallpaperUI
+    from derpiwallpaper.ui_updates import UiUpdateBus
+    from derpiwallpaper.workers import WorkerManager
+
+    app = DerpiWallpaperApp()
+    workers = WorkerManager(ui_updates=UiUpdateBus())
+    widget = DerpiWallpaperUI()
+    widget.show()
+
+    gui_seconds: list[float] = []
+    state = {"remaining": refreshes, "started": 0.0, "refreshing": False}
+
+    def poll():
+        # Runs on the GUI thread, so thread_time() is the CPU time the GUI thread used
+        updater = workers.wp_updater
+        if state["refreshing"] and not updater.refreshing and not updater.get_next_refresh_time():
+            app.processEvents()
+            gui_seconds.append(time.thread_time() - state["started"])
+            state["refreshing"] = False
+        if not state["refreshing"]:
+            if not state["remaining"]:
+                app.quit()
+                return
+            state["remaining"] -= 1
+            state["refreshing"] = True
+            state["started"] = time.thread_time()
+            widget.refresh_wp()
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    QTimer.singleShot(1000, lambda: timer.start(50))  # Let startup work settle
+    app.exec()
+
+    result = {
+        "refreshes": refreshes,
+        "image_bytes": IMAGE_SIZE,
+        "gui_ms_per_refresh": round(sum(gui_seconds) / len(gui_seconds) * 1000, 2),
+        "gui_ms_per_refresh_max": round(max(gui_seconds) * 1000, 2),
+    }
+    workers.stop()
+    server.shutdown()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,27 @@ import signal
 import sys
 from typing import Callable
 
-from derpiwallpaper.ui import DerpiWallpaperApp
-from derpiwallpaper.workers import WorkerManager
+from derpiwallpaper.config import get_conf
+from derpiwallpaper.search_index import close_index
+from derpiwallpaper.utils.http import close_http
+from derpiwallpaper.utils.metrics import start_metrics_server
 
 if __name__ == "__main__":
 
+    # Without a GUI, Qt widgets are never imported
+    if "--headless" in sys.argv:
+        from derpiwallpaper.headless import run_headless
+        sys.exit(run_headless(refresh_on_start="--refresh-on-start" in sys.argv))
+
+    from derpiwallpaper.ui import DerpiWallpaperApp
+    from derpiwallpaper.ui_updates import UiUpdateBus
+    from derpiwallpaper.workers import WorkerManager
+
     # Configure exit callbacks
     exit_callbacks: set[Callable] = set()
     def prepare_exit():
+        # Pending input has to reach the config before it's flushed
+        app.before_exit.emit()
         for callback in exit_callbacks:
             callback()
 
@@ -22,12 +35,21 @@ if __name__ == "__main__":
 
     try:
         # Initialize wallpaper manager
-        workers = WorkerManager()
+        workers = WorkerManager(ui_updates=UiUpdateBus())
         def stop_workers():
             print("Stopping workers before exiting...")
             workers.stop()
+            close_http()
+            close_index()
+            get_conf().flush()
+            print(get_conf().get_write_stats())
         exit_callbacks.add(stop_workers)
 
+        # Serve metrics to local scrapers if enabled
+        if get_conf().metrics_port:
+            metrics_server = start_metrics_server(get_conf().metrics_port)
+            exit_callbacks.add(metrics_server.shutdown)
+
         # Configure exit signal handling
         def handle_exit_signal(signal_received, frame):
             app.quit()
@@ -36,7 +58,7 @@ if __name__ == "__main__":
         signal.signal(signal.SIGTERM, handle_exit_signal)  # Handle termination
 
         # Exit on worker error
-        workers.on_error.connect(app.exit_with_error_popup)
+        workers.on_error(app.worker_error.emit)
 
         # Run Qt app
         sys.exit(app.exec())
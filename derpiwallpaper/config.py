@@ -1,5 +1,10 @@
+from collections import namedtuple
 from configparser import ConfigParser, ParsingError
 from pathlib import Path
+from threading import RLock, Timer
+from typing import Any, Callable, NamedTuple
+import os
+import tempfile
 from appdirs import user_config_dir
 
 from derpiwallpaper.utils import get_user_images_folder
@@ -26,12 +31,35 @@ class DerpiWallpaperConfig:
     current_wallpaper_path: str = ""
     wallpapers_to_keep: int = 100
     wallpaper_folder: Path = get_user_images_folder() / "DerpiWallpaper"
+    prefetch_depth: int = 2  # Number of images to download ahead of time so refreshes apply instantly
+    http_pool_connections: int = 4  # Number of hosts to keep connection pools for (API + CDN)
+    http_pool_maxsize: int = 4  # Number of keep-alive connections to keep per host
+    api_rate_limit_per_second: float = 1.0  # Sustained rate of derpibooru API requests shared by all workers
+    api_rate_limit_burst: int = 3  # Number of API requests that may be sent back to back after being idle
+    cdn_rate_limit_per_second: float = 4.0  # Sustained rate of image downloads
+    cdn_rate_limit_burst: int = 4
+    metrics_port: int = 0  # Port of the local metrics endpoint on 127.0.0.1, 0 disables it
+    http_cache_size_mb: int = 16  # Size of the on-disk cache of API responses, 0 disables it
 
     @property
     def appdir(self) -> Path:
         return Path(user_config_dir(appname="DerpiWallpaper", appauthor=False))
 
+    _schema: dict[str, tuple[type, Any]]  # Configurable attributes with their type and default value, built once
+    _snapshot_type: type[NamedTuple]
+    _snapshot: NamedTuple
+    _listeners: dict[str, list[Callable[[Any], None]]]
+    _lock: RLock
+    _flush_timer: Timer | None = None
+    _dirty: bool = False
+    _save_requests: int = 0  # Number of changes that requested a save
+    _disk_writes: int = 0  # Number of times the config file was actually written
+
     def __init__(self):
+        self._lock = RLock()
+        self._listeners = {}
+        self._snapshot = self._snapshot_type(**{key: default for key, (_, default) in self._schema.items()})
+
         # Define the config path using appdirs
         config_dir = self.appdir
         config_dir.mkdir(parents=True, exist_ok=True)
@@ -53,10 +81,9 @@ class DerpiWallpaperConfig:
             self.config["DerpiWallpaper"] = {}
 
         # Load or initialize attributes from the file
-        for attr_name, default_value in self._get_configurable_attrs().items():
+        for attr_name, (attr_type, default_value) in self._schema.items():
             # Load from config file if present, otherwise set default
             if attr_name in self.config["DerpiWallpaper"]:
-                attr_type = type(default_value)
                 loaded_value = self.config["DerpiWallpaper"][attr_name]
                 # Convert the loaded string to the attribute's type
                 if attr_type == bool:
@@ -69,26 +96,98 @@ class DerpiWallpaperConfig:
 
         # Save to ensure any missing defaults are written to the file
         self._save()
+        self.flush()
+        self._save_requests = self._disk_writes = 0  # Only count changes made after loading
         print(f'Loaded configuration from "{self.config_path}"')
 
     def __setattr__(self, key, value):
         # Only process configurable attributes (i.e., those not starting with '_')
-        if key in self._get_configurable_attrs():
-            # Update the config parser and write to file
+        if key not in self._schema:
+            super().__setattr__(key, value)
+            return
+
+        # Update the config parser, the snapshot and schedule a write to file
+        with self._lock:
+            changed = getattr(self._snapshot, key) != value
             if self.config.get("DerpiWallpaper", key, fallback=None) != str(value):
                 self.config["DerpiWallpaper"][key] = str(value)
                 self._save()
-        # Call the superclass's setattr to actually set the attribute
-        super().__setattr__(key, value)
+            # Call the superclass's setattr to actually set the attribute
+            super().__setattr__(key, value)
+            if changed:
+                self._snapshot = self._snapshot._replace(**{key: value})
+                listeners = list(self._listeners.get(key, ()))
+            else:
+                listeners = []
+
+        # Notify outside of the lock so listeners can read the config again
+        for listener in listeners:
+            listener(value)
+
+    def snapshot(self) -> NamedTuple:
+        """Returns an immutable snapshot of all configurable values.
+
+        The snapshot is replaced as a whole on every change, so worker threads can read consistent values without locking.
+        """
+        return self._snapshot
 
-    def _get_configurable_attrs(self):
-        """Return a dictionary of configurable attributes with their default values."""
-        return {attr: getattr(self, attr) for attr in self.__class__.__annotations__ if not attr.startswith("_")}
+    def on_change(self, key: str, listener: Callable[[Any], None]) -> Callable[[], None]:
+        """Calls listener with the new value whenever the given key changes. Returns a function that removes the listener.
+
+        Listeners run on the thread that changed the value and should only hand work off (e.g. wake a worker).
+        """
+        if key not in self._schema:
+            raise KeyError(f'"{key}" is not a configurable attribute.')
+        with self._lock:
+            self._listeners.setdefault(key, []).append(listener)
+
+        def remove_listener():
+            with self._lock:
+                if listener in self._listeners.get(key, ()):
+                    self._listeners[key].remove(listener)
+        return remove_listener
 
     def _save(self):
-        """Writes the current configuration to the config file."""
-        with open(self.config_path, "w") as configfile:
-            self.config.write(configfile)
+        """Schedules a write of the current configuration, bursts of changes (e.g. typing) are coalesced into one write."""
+        with self._lock:
+            self._dirty = True
+            self._save_requests += 1
+            if not self._flush_timer:
+                self._flush_timer = Timer(SAVE_DEBOUNCE_SECONDS, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """Writes pending changes to the config file. The file is replaced atomically so it's never left half written."""
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+
+            fd, temp_name = tempfile.mkstemp(dir=self.config_path.parent, prefix=".config-", suffix=".ini")
+            try:
+                with os.fdopen(fd, "w") as configfile:
+                    self.config.write(configfile)
+                os.replace(temp_name, self.config_path)
+            except BaseException:
+                Path(temp_name).unlink(missing_ok=True)
+                raise
+            self._dirty = False
+            self._disk_writes += 1
+
+    def get_write_stats(self) -> str:
+        """Returns a summary of how many disk writes were saved by coalescing config changes."""
+        return f"{self._save_requests} config changes written in {self._disk_writes} disk writes ({self._save_requests - self._disk_writes} writes saved)"
+
+
+# Build the schema once from the annotated class attributes instead of inspecting the class on every change
+DerpiWallpaperConfig._schema = {
+    attr: (type(getattr(DerpiWallpaperConfig, attr)), getattr(DerpiWallpaperConfig, attr))
+    for attr in DerpiWallpaperConfig.__annotations__ if not attr.startswith("_")
+}
+DerpiWallpaperConfig._snapshot_type = namedtuple("ConfigSnapshot", DerpiWallpaperConfig._schema)  # type: ignore
 
 
 _CONFIG: None | DerpiWallpaperConfig = None
@@ -106,4 +205,12 @@ def get_conf():
 
     return _CONFIG
 
+SAVE_DEBOUNCE_SECONDS = 1.0  # Delay before changed config values are written to disk
+SEARCH_INPUT_DEBOUNCE_SECONDS = 0.4  # Typing pause after which the search string is applied and searched for
 CLEANUP_INTERVAL = 60  # Intentionally hardcoded to avoid accidental cleanup
+RATE_LIMIT_RETRIES = 3  # Number of times a request answered with HTTP 429 is retried
+HTTP_CONNECT_TIMEOUT = 5.0  # Seconds to wait for a connection to derpibooru or its CDN
+HTTP_READ_TIMEOUT = 15.0  # Seconds to wait for the next bytes of a response before giving up
+WALL_CLOCK_RECHECK_SECONDS = 60.0  # Longest sleep before a wall-clock deadline is checked again, e.g. after the system was suspended
+SHUTDOWN_TIMEOUT = 0.5  # Seconds all workers together get to stop, workers still busy afterwards are abandoned
+PAGE_SIZE = 50  # Maximum number of images per page allowed by the API for anon keys
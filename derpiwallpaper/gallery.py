@@ -0,0 +1,107 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QPersistentModelIndex, QSize, Qt
+from PySide6.QtGui import QGuiApplication, QImage, QPixmap
+from PySide6.QtWidgets import QListView
+
+from derpiwallpaper.thumbnails import get_thumbnails
+from derpiwallpaper.wallpaper_index import get_wallpaper_index
+from derpiwallpaper.workers import wman
+
+GALLERY_THUMBNAIL_SIZE = QSize(160, 90)
+GALLERY_PIXMAP_CACHE_SIZE = 128  # Number of thumbnail pixmaps the gallery keeps, only a few screens are ever visible
+
+
+class WallpaperGalleryModel(QAbstractListModel):
+    """List of all kept wallpapers, newest first.
+
+    Thumbnails are only requested when the view asks for a row's decoration, which it only does for visible rows.
+    Until a thumbnail is decoded in the background the row shows no image.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._paths: list[Path] = []
+        self._rows: dict[str, int] = {}
+        self._pixmaps: OrderedDict[str, QPixmap] = OrderedDict()
+        self._requested: set[str] = set()
+        self._hidpi_factor = QGuiApplication.primaryScreen().devicePixelRatio()
+        self._thumbnail_size = GALLERY_THUMBNAIL_SIZE * self._hidpi_factor
+        get_thumbnails().thumbnail_ready.connect(self._on_thumbnail_ready, Qt.ConnectionType.QueuedConnection)
+        self.reload()
+
+    def reload(self):
+        """Reloads the list of wallpapers from the wallpaper index, without touching any of the files."""
+        prefetched = set(wman().wp_updater.get_prefetched_paths())
+        paths = [path for path in get_wallpaper_index().paths() if path not in prefetched]
+        if paths == self._paths:
+            return
+        self.beginResetModel()
+        self._paths = paths
+        self._rows = {str(path): row for row, path in enumerate(paths)}
+        self.endResetModel()
+
+    def path(self, index: QModelIndex | QPersistentModelIndex) -> Path:
+        return self._paths[index.row()]
+
+    def rowCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._paths)
+
+    def data(self, index: QModelIndex | QPersistentModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid() or index.row() >= len(self._paths):
+            return None
+        path = str(self._paths[index.row()])
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return self._paths[index.row()].name
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self._pixmaps.get(path)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(path)
+                return pixmap
+            if path not in self._requested:
+                self._requested.add(path)
+                get_thumbnails().request(path, self._thumbnail_size, cancellable=True)
+        return None
+
+    def cancel_pending(self):
+        """Forgets thumbnail requests that weren't processed yet, visible rows request them again when repainted."""
+        get_thumbnails().cancel_pending()
+        self._requested.clear()
+
+    def _on_thumbnail_ready(self, path: str, size: QSize, image: QImage):
+        if size != self._thumbnail_size or path not in self._requested:
+            return
+        self._requested.discard(path)
+        pixmap = QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self._hidpi_factor)
+        self._pixmaps[path] = pixmap
+        while len(self._pixmaps) > GALLERY_PIXMAP_CACHE_SIZE:
+            self._pixmaps.popitem(last=False)
+
+        row = self._rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+
+class WallpaperGalleryView(QListView):
+    """Virtualized grid of wallpaper thumbnails, clicking one applies it as wallpaper."""
+
+    def __init__(self, model: WallpaperGalleryModel) -> None:
+        super().__init__()
+        self.setViewMode(QListView.ViewMode.IconMode)
+        self.setIconSize(GALLERY_THUMBNAIL_SIZE)
+        self.setGridSize(GALLERY_THUMBNAIL_SIZE + QSize(8, 8))
+        self.setUniformItemSizes(True)  # Lets the view lay out thousands of rows without asking the model for each
+        self.setLayoutMode(QListView.LayoutMode.Batched)
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setMovement(QListView.Movement.Static)
+        self.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self.setModel(model)
+
+        # Requests for rows that were scrolled past are dropped, so the visible ones are decoded first
+        self.verticalScrollBar().valueChanged.connect(lambda _: model.cancel_pending())
+        self.clicked.connect(lambda index: wman().wp_updater.apply_wallpaper(model.path(index)))
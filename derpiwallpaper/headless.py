@@ -0,0 +1,54 @@
+from __future__ import annotations
+from datetime import datetime
+from threading import Event
+import signal
+import traceback
+
+from derpiwallpaper.config import get_conf
+from derpiwallpaper.search_index import close_index
+from derpiwallpaper.utils.http import close_http
+from derpiwallpaper.utils.metrics import start_metrics_server
+from derpiwallpaper.workers import WorkerManager
+
+
+def run_headless(refresh_on_start: bool = False) -> int:
+    """Runs the workers without any GUI until SIGINT/SIGTERM or a worker error. Returns the exit code.
+
+    Neither Qt widgets nor a Qt event loop are needed, wallpapers rotate according to the config file.
+    """
+    stop = Event()
+    errors: list[Exception] = []
+
+    def handle_exit_signal(signal_received, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, handle_exit_signal)  # Handle Ctrl+C
+    signal.signal(signal.SIGTERM, handle_exit_signal)  # Handle termination
+
+    workers = WorkerManager()
+    metrics_server = start_metrics_server(get_conf().metrics_port) if get_conf().metrics_port else None
+    try:
+        # Exit on worker error
+        def on_worker_error(error: Exception):
+            errors.append(error)
+            stop.set()
+        workers.on_error(on_worker_error)
+
+        if refresh_on_start:
+            workers.wp_updater.schedule_refresh(datetime.now(), update_ui=False)
+
+        print("Running headless, press Ctrl+C to stop.")
+        stop.wait()
+    finally:
+        print("Stopping workers before exiting...")
+        if metrics_server:
+            metrics_server.shutdown()
+        workers.stop()
+        close_http()
+        close_index()
+        get_conf().flush()
+        print(get_conf().get_write_stats())
+
+    for error in errors:
+        traceback.print_exception(error)
+    return 1 if errors else 0
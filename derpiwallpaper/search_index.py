@@ -0,0 +1,126 @@
+from __future__ import annotations
+from threading import Lock
+import json
+import sqlite3
+import time
+
+from derpiwallpaper.config import get_conf
+
+
+class SearchIndex:
+    """On-disk index of the image records returned by derpibooru for each search string.
+
+    The index is filled from every fetched page and kept current by only asking the API for images newer than the
+    highest id that was fully synced, so refreshes can be served from disk and keep working while offline.
+    """
+
+    def __init__(self, path) -> None:
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS queries (
+                    query TEXT PRIMARY KEY,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    synced_max_id INTEGER,
+                    synced_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS images (
+                    query TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    view_url TEXT NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    score INTEGER,
+                    format TEXT,
+                    tags TEXT,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (query, id)
+                );
+            """)
+
+    def add_images(self, query: str, images: list[dict]):
+        """Adds or updates image records returned by the API for a search string."""
+        rows = [
+            (
+                query,
+                image["id"],
+                image["view_url"],
+                image.get("width"),
+                image.get("height"),
+                image.get("score"),
+                image.get("format"),
+                ",".join(image.get("tags", [])),
+                json.dumps(image),
+            )
+            for image in images
+            if "id" in image and "view_url" in image
+        ]
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO queries (query) VALUES (?)", (query,))
+            self._db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def set_total(self, query: str, total: int):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO queries (query, total) VALUES (?, ?) ON CONFLICT(query) DO UPDATE SET total = excluded.total",
+                (query, total),
+            )
+
+    def get_total(self, query: str) -> int | None:
+        """Returns the last known number of results for a search string."""
+        with self._lock:
+            row = self._db.execute("SELECT total FROM queries WHERE query = ?", (query,)).fetchone()
+        return row[0] if row else None
+
+    def set_synced_max_id(self, query: str, max_id: int):
+        """Marks all images up to max_id as synced, later syncs only ask for newer images."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE queries SET synced_max_id = ?, synced_at = ? WHERE query = ?",
+                (max_id, time.time(), query),
+            )
+
+    def get_synced_max_id(self, query: str) -> int | None:
+        with self._lock:
+            row = self._db.execute("SELECT synced_max_id FROM queries WHERE query = ?", (query,)).fetchone()
+        return row[0] if row else None
+
+    def count(self, query: str) -> int:
+        """Returns the number of indexed images for a search string."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images WHERE query = ?", (query,)).fetchone()[0]
+
+    def random_image(self, query: str) -> dict | None:
+        """Returns a random indexed image record for a search string."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT record FROM images WHERE query = ? ORDER BY RANDOM() LIMIT 1", (query,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_INDEX: SearchIndex | None = None
+_INDEX_LOCK = Lock()
+def get_index() -> SearchIndex:
+    """Returns the global search index and makes sure it's initialized."""
+
+    global _INDEX
+    with _INDEX_LOCK:
+        if not _INDEX:
+            _INDEX = SearchIndex(get_conf().appdir / "search_index.sqlite3")
+    return _INDEX
+
+
+def close_index():
+    """Closes the global search index, if it was initialized."""
+
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX:
+            _INDEX.close()
+            _INDEX = None
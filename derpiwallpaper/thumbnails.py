@@ -0,0 +1,143 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+import hashlib
+import os
+
+from PySide6.QtCore import QObject, QRunnable, QSize, QThread, QThreadPool, Qt, Signal, SignalInstance
+from PySide6.QtGui import QImage, QImageReader
+
+from derpiwallpaper.config import get_conf
+
+THUMBNAIL_MEMORY_CACHE_SIZE = 256  # Number of decoded thumbnails kept in memory, enough for a few screens of the gallery
+THUMBNAIL_DISK_CACHE_SIZE = 2000  # Number of thumbnail files kept in the thumbnail folder
+THUMBNAIL_DISK_TRIM_INTERVAL = 100  # Number of new thumbnail files after which the thumbnail folder is trimmed
+
+
+class ThumbnailCache(QObject):
+    """Decodes and scales thumbnails on a background thread and keeps them in an in-memory and an on-disk LRU cache.
+
+    Thumbnails are keyed by path, modification time and size, so a changed file is never served from the cache.
+    """
+    thumbnail_ready: SignalInstance = Signal(str, QSize, QImage)  # type: ignore # Emitted with the image path, the requested size and the thumbnail
+
+    def __init__(self, folder: Path) -> None:
+        super().__init__()
+        self._folder = folder
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._lock = Lock()
+        self._memory: OrderedDict[str, QImage] = OrderedDict()
+        self._new_files = 0
+        self._cancellable_jobs: list[_ThumbnailJob] = []
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(max(1, min(4, QThread.idealThreadCount())))
+
+    def _key(self, path: Path, size: QSize) -> str | None:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return hashlib.sha1(f"{path}|{stat.st_mtime_ns}|{size.width()}x{size.height()}".encode()).hexdigest()
+
+    def get_cached(self, path: str | Path, size: QSize) -> QImage | None:
+        """Returns a thumbnail if it's cached in memory, without decoding anything."""
+        key = self._key(Path(path), size)
+        with self._lock:
+            image = self._memory.get(key) if key else None
+            if image is not None:
+                self._memory.move_to_end(key)
+        return image
+
+    def cancel_pending(self):
+        """Drops cancellable requests that haven't started yet, e.g. because their thumbnails were scrolled out of view."""
+        for job in self._cancellable_jobs:
+            self._pool.tryTake(job)
+        self._cancellable_jobs.clear()
+
+    def request(self, path: str | Path, size: QSize, cancellable: bool = False):
+        """Emits thumbnail_ready once the thumbnail is available, right away if it's cached in memory."""
+        path = Path(path)
+        key = self._key(path, size)
+        if not key:
+            self.thumbnail_ready.emit(str(path), size, QImage())
+            return
+
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+        if image is not None:
+            self.thumbnail_ready.emit(str(path), size, image)
+        else:
+            job = _ThumbnailJob(self, path, size, key)
+            if cancellable:
+                # Keep a reference so the job can still be taken out of the queue, finished ones are dropped on cancel
+                job.setAutoDelete(False)
+                self._cancellable_jobs.append(job)
+            self._pool.start(job)
+
+    def _load(self, path: Path, size: QSize, key: str) -> QImage:
+        """Returns the thumbnail from the disk cache or decodes it from the image, runs on the thread pool."""
+        cache_file = self._folder / f"{key}.png"
+        image = QImage(str(cache_file)) if cache_file.is_file() else QImage()
+        if image.isNull():
+            # Let the decoder scale while reading, so the full image is never held in memory
+            reader = QImageReader(str(path))
+            reader.setAutoTransform(True)
+            original_size = reader.size()
+            if original_size.isValid():
+                reader.setScaledSize(original_size.scaled(size, Qt.AspectRatioMode.KeepAspectRatio))
+            image = reader.read()
+            if image.isNull():
+                return image
+            image.save(str(cache_file), "PNG")
+            with self._lock:
+                self._new_files += 1
+                trim = self._new_files >= THUMBNAIL_DISK_TRIM_INTERVAL
+                if trim:
+                    self._new_files = 0
+            if trim:
+                self._trim_disk_cache()
+        else:
+            # Mark the thumbnail as recently used for the disk LRU
+            os.utime(cache_file)
+
+        with self._lock:
+            self._memory[key] = image
+            self._memory.move_to_end(key)
+            while len(self._memory) > THUMBNAIL_MEMORY_CACHE_SIZE:
+                self._memory.popitem(last=False)
+        return image
+
+    def _trim_disk_cache(self):
+        with os.scandir(self._folder) as it:
+            files = [entry for entry in it if entry.name.endswith(".png")]
+        if len(files) > THUMBNAIL_DISK_CACHE_SIZE:
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:-THUMBNAIL_DISK_CACHE_SIZE]:
+                Path(entry.path).unlink(missing_ok=True)
+
+
+class _ThumbnailJob(QRunnable):
+    def __init__(self, cache: ThumbnailCache, path: Path, size: QSize, key: str) -> None:
+        super().__init__()
+        self._cache = cache
+        self._path = path
+        self._size = size
+        self._key = key
+
+    def run(self):
+        image = self._cache._load(self._path, self._size, self._key)
+        # The signal is queued to the GUI thread, where the thumbnail can be turned into a pixmap
+        self._cache.thumbnail_ready.emit(str(self._path), self._size, image)
+
+
+_THUMBNAILS: ThumbnailCache | None = None
+def get_thumbnails() -> ThumbnailCache:
+    """Returns the global thumbnail cache and makes sure it's initialized. Must be called from the Qt main thread first."""
+
+    global _THUMBNAILS
+    if not _THUMBNAILS:
+        _THUMBNAILS = ThumbnailCache(get_conf().appdir / "thumbnails")
+    return _THUMBNAILS
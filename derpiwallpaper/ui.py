@@ -2,13 +2,18 @@
 
 from datetime import datetime
 from pathlib import Path
-from PySide6.QtCore import Qt, QEvent, SignalInstance, Slot, Signal, QUrl
-from PySide6.QtGui import QIcon, QAction, QGuiApplication
+from typing import Callable
+from PySide6.QtCore import Qt, QEvent, QSize, QTimer, SignalInstance, Slot, Signal, QUrl
+from PySide6.QtGui import QIcon, QAction, QGuiApplication, QImage
 from PySide6.QtWidgets import QGridLayout, QLabel, QLineEdit, QProgressBar, QPushButton, QWidget, QGroupBox, QCheckBox, QSpinBox, QSystemTrayIcon, QMenu, QMainWindow, QApplication, QMessageBox
 from PySide6.QtGui import QDesktopServices, QPixmap, QPainter
 
 from derpiwallpaper.autostart import is_run_on_startup, configure_run_on_startup
-from derpiwallpaper.config import get_conf, DATA_PATH, PACKAGE_VERSION
+from derpiwallpaper.config import SEARCH_INPUT_DEBOUNCE_SECONDS, get_conf, DATA_PATH, PACKAGE_VERSION
+from derpiwallpaper.gallery import WallpaperGalleryModel, WallpaperGalleryView
+from derpiwallpaper.thumbnails import get_thumbnails
+from derpiwallpaper.ui_updates import UiUpdateBus
+from derpiwallpaper.utils.screens import track_screens
 from derpiwallpaper.workers import WorkerManager, wman
 import traceback
 from urllib.parse import quote
@@ -18,11 +23,15 @@ ICON_PATH = DATA_PATH / "derpiwallpaper.ico"
 class DerpiWallpaperApp(QApplication):
     start_minimized: bool
     refresh_on_start: bool
+    worker_error: SignalInstance = Signal(Exception)  # type: ignore # Hands errors of worker threads over to the GUI thread
+    before_exit: SignalInstance = Signal()  # type: ignore # Emitted on quit before the workers stop and the config is flushed, to apply pending input
 
     def __init__(self, start_minimized = False, refresh_on_start=False) -> None:
         super().__init__()
         self.start_minimized = start_minimized
         self.refresh_on_start = refresh_on_start
+        self.worker_error.connect(self.exit_with_error_popup)
+        track_screens()
 
     @Slot(Exception)
     def exit_with_error_popup(self, error: Exception):
@@ -112,11 +121,14 @@ class DerpiWallpaperApp(QApplication):
 class DerpiWallpaperUI(QWidget):
     tray_icon: QSystemTrayIcon | None = None
     wman: WorkerManager
+    ui_updates: UiUpdateBus
 
     def __init__(self) -> None:
         super().__init__()
         self.icon = QIcon(str(ICON_PATH))
         self.wman = wman()
+        assert isinstance(self.wman.ui_updates, UiUpdateBus), 'The worker manager must report UI updates to a UiUpdateBus.'
+        self.ui_updates = self.wman.ui_updates
 
         layout = QGridLayout(self)
         layout.addWidget(self.create_search_options_widget(), 0, 0)
@@ -134,6 +146,9 @@ class DerpiWallpaperUI(QWidget):
         self.setWindowIcon(QIcon(str(ICON_PATH)))
         self.configure_minimize_to_tray(get_conf().minimize_to_tray)
 
+        # Updates start flowing once the window is shown, it may start hidden in the tray
+        self.ui_updates.set_paused(True)
+
     def configure_minimize_to_tray(self, enabled: bool):
         if enabled:
             # Set up the tray icon
@@ -177,6 +192,23 @@ class DerpiWallpaperUI(QWidget):
         self.showNormal()
         self.activateWindow()
 
+    def on_ui_update(self, fields: set[str], callback: Callable[[], None]):
+        """Calls callback once per frame in which at least one of the given fields became dirty."""
+        def on_updated(dirty_fields: set[str]):
+            if dirty_fields & fields:
+                callback()
+        self.ui_updates.updated.connect(on_updated)
+
+    def showEvent(self, event):
+        # Catch up on everything that changed while the window was hidden
+        self.ui_updates.set_paused(False)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        # Don't redraw anything while hidden, e.g. in the tray
+        self.ui_updates.set_paused(True)
+        super().hideEvent(event)
+
     def event(self, event):
         """Override to hide the window on minimize."""
         if event.type() == QEvent.Type.WindowStateChange:
@@ -192,7 +224,21 @@ class DerpiWallpaperUI(QWidget):
         search_input = QLineEdit(get_conf().search_string)
         search_input.setPlaceholderText("Enter derpibooru.org search string...")
         search_input.setToolTip("derpibooru.org search string")
-        search_input.textChanged.connect(lambda search_string: setattr(get_conf(), "search_string", search_string))
+
+        # Apply the search string once typing pauses, otherwise every intermediate value would be searched for
+        search_debounce = QTimer(self)
+        search_debounce.setSingleShot(True)
+        search_debounce.setInterval(int(SEARCH_INPUT_DEBOUNCE_SECONDS * 1000))
+        def apply_search_string():
+            search_debounce.stop()
+            get_conf().search_string = search_input.text()
+        search_debounce.timeout.connect(apply_search_string)
+        search_input.textChanged.connect(lambda _: search_debounce.start())
+        # Enter, leaving the field and quitting apply pending input right away
+        search_input.editingFinished.connect(apply_search_string)
+        app = QApplication.instance()
+        assert isinstance(app, DerpiWallpaperApp)
+        app.before_exit.connect(apply_search_string)
 
         search_results = QLabel("Searching for images...")
         search_description = QLabel("See <a href=\"https://derpibooru.org/pages/search_syntax\">Search Syntax</a> for instructions on how to build your search string.")
@@ -209,7 +255,7 @@ class DerpiWallpaperUI(QWidget):
             search_results.setStyleSheet(style)
             search_results.setText(results_text)
         update_search_options_widget()
-        self.wman.search.update_ui.connect(update_search_options_widget)
+        self.on_ui_update({"search"}, update_search_options_widget)
 
         # Layout
         widget = QGroupBox("Search")
@@ -245,7 +291,6 @@ class DerpiWallpaperUI(QWidget):
         auto_refresh_checkbox.setChecked(get_conf().enable_auto_refresh)
         def toggle_auto_refresh(enabled: bool):
             get_conf().enable_auto_refresh = enabled
-            self.wman.wp_updater.clear_refresh()
         auto_refresh_checkbox.toggled.connect(toggle_auto_refresh)
 
         auto_refresh_interval_label = QLabel("Every:")
@@ -288,20 +333,37 @@ class DerpiWallpaperUI(QWidget):
         wallpapers_to_keep.setValue(get_conf().wallpapers_to_keep)
         def set_wallpapers_to_keep(number: int):
             get_conf().wallpapers_to_keep = number
-            self.wman.cleanup.schedule_cleanup()
         wallpapers_to_keep.valueChanged.connect(set_wallpapers_to_keep)
 
         current_wallpaper_label = QLabel("Current wallpaper:")
         current_wallpaper_image = QLabel()
         current_wallpaper_image.setFixedSize(160, 90)
         current_wallpaper_image.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        shown_wallpaper_path: str | None = None
         def update_current_wallpaper():
+            # Only request a new thumbnail when the wallpaper changed, not on every progress update
+            nonlocal shown_wallpaper_path
+            if get_conf().current_wallpaper_path == shown_wallpaper_path:
+                return
+            shown_wallpaper_path = get_conf().current_wallpaper_path
             hidpi_factor = QGuiApplication.primaryScreen().devicePixelRatio()
-            pixmap = QPixmap(get_conf().current_wallpaper_path).scaled(int(160*hidpi_factor), int(90*hidpi_factor), Qt.AspectRatioMode.KeepAspectRatio)
-            pixmap.setDevicePixelRatio(hidpi_factor)
+            get_thumbnails().request(shown_wallpaper_path, QSize(int(160*hidpi_factor), int(90*hidpi_factor)))
+        def show_thumbnail(path: str, size: QSize, image: QImage):
+            # Thumbnails are decoded in the background, drop the ones of wallpapers that were replaced in the meantime
+            if path != shown_wallpaper_path:
+                return
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(size.width() / 160)
             current_wallpaper_image.setPixmap(pixmap)
+        get_thumbnails().thumbnail_ready.connect(show_thumbnail)
         update_current_wallpaper()
-        self.wman.wp_updater.update_ui.connect(update_current_wallpaper)
+        self.on_ui_update({"wallpaper"}, update_current_wallpaper)
+
+        gallery_label = QLabel("Kept wallpapers (click to apply):")
+        gallery_model = WallpaperGalleryModel()
+        gallery = WallpaperGalleryView(gallery_model)
+        gallery.setMinimumSize(360, 200)
+        self.on_ui_update({"gallery"}, gallery_model.reload)
 
         open_wallpaper_folder_button = QPushButton("Open wallpaper folder")
         open_wallpaper_folder_button.clicked.connect(lambda: QDesktopServices.openUrl(QUrl.fromLocalFile(str(get_conf().wallpaper_folder))))
@@ -313,9 +375,11 @@ class DerpiWallpaperUI(QWidget):
         # Add elements to layout
         layout.addWidget(current_wallpaper_label,     0, 0, 1, 2)
         layout.addWidget(current_wallpaper_image,     1, 0, 1, 2)
-        layout.addWidget(open_wallpaper_folder_button, 2, 0, 1, 2)
-        layout.addWidget(wallpapers_to_keep_label, 3, 0)
-        layout.addWidget(wallpapers_to_keep,       3, 1)
+        layout.addWidget(gallery_label,               2, 0, 1, 2)
+        layout.addWidget(gallery,                     3, 0, 1, 2)
+        layout.addWidget(open_wallpaper_folder_button, 4, 0, 1, 2)
+        layout.addWidget(wallpapers_to_keep_label, 5, 0)
+        layout.addWidget(wallpapers_to_keep,       5, 1)
 
         return widget
 
@@ -328,7 +392,7 @@ class DerpiWallpaperUI(QWidget):
         update_wallpaper_button.clicked.connect(self.refresh_wp)
         update_wallpaper_button.setMinimumHeight(update_wallpaper_button.fontMetrics().lineSpacing() * 2 + 8)
         update_progress_bar = QProgressBar()
-        update_progress_bar.setMaximum(self.wman.wp_updater.max_steps)
+        update_progress_bar.setMaximum(1)
         update_error_label = QLabel("blub")
         update_error_label.setStyleSheet("color: red")
         update_error_label.hide()
@@ -337,13 +401,19 @@ class DerpiWallpaperUI(QWidget):
         def update_update_widget():
             """Updates the progress bar and reenables the button."""
 
-            update_progress_bar.setValue(self.wman.wp_updater.progress)
+            # Progress is reported in bytes, a maximum of 0 shows a busy indicator while the size is unknown
+            if self.wman.wp_updater.refreshing:
+                update_progress_bar.setMaximum(self.wman.wp_updater.max_steps)
+                update_progress_bar.setValue(min(self.wman.wp_updater.progress, self.wman.wp_updater.max_steps))
+            else:
+                update_progress_bar.setMaximum(1)
+                update_progress_bar.setValue(1)
 
             # Update Button
             if not self.wman.search.current_result_count:
                 update_wallpaper_button.setDisabled(True)
                 update_wallpaper_button.setText("No wallpapers found.")
-            elif self.wman.wp_updater.progress < self.wman.wp_updater.max_steps:
+            elif self.wman.wp_updater.refreshing:
                 update_wallpaper_button.setDisabled(True)
                 update_wallpaper_button.setText("Updating wallpaper...")
             else:
@@ -363,8 +433,7 @@ class DerpiWallpaperUI(QWidget):
             else:
                 update_error_label.hide()
         update_update_widget()
-        self.wman.wp_updater.update_ui.connect(update_update_widget)
-        self.wman.search.update_ui.connect(update_update_widget)
+        self.on_ui_update({"search", "refresh", "progress"}, update_update_widget)
 
         layout = QGridLayout()
         layout.addWidget(update_wallpaper_button, 0, 0, 1, 4)
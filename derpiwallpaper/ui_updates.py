@@ -0,0 +1,52 @@
+from __future__ import annotations
+from threading import Lock
+
+from PySide6.QtCore import QObject, QTimer, Signal, SignalInstance
+
+from derpiwallpaper.workers import UiUpdates
+
+
+class UiUpdateBus(QObject, UiUpdates):
+    """Collects which parts of the UI are outdated and reports them to the GUI thread at most once per frame.
+
+    Workers mark fields as dirty from any thread ("search", "refresh", "progress", "wallpaper" or "gallery"). Bursts are coalesced
+    into a single updated signal with all dirty fields, nothing is sent while paused (e.g. the window is hidden in the tray).
+    """
+    updated: SignalInstance = Signal(object)  # type: ignore # Emitted with the set of dirty fields
+    frame_interval_ms: int = 16
+    _schedule: SignalInstance = Signal()  # type: ignore # Hands the flush timer start over to the GUI thread
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = Lock()
+        self._dirty: set[str] = set()
+        self._paused = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self._schedule.connect(self._start_timer)
+
+    def mark_dirty(self, *fields: str):
+        with self._lock:
+            schedule = not self._dirty
+            self._dirty.update(fields)
+        if schedule:
+            self._schedule.emit()
+
+    def set_paused(self, paused: bool):
+        """Stops sending updates while paused, everything that became dirty in the meantime is sent on resume."""
+        self._paused = paused
+        if not paused:
+            self.flush()
+
+    def _start_timer(self):
+        if not self._paused and not self._timer.isActive():
+            self._timer.start(self.frame_interval_ms)
+
+    def flush(self):
+        if self._paused:
+            return
+        with self._lock:
+            fields, self._dirty = self._dirty, set()
+        if fields:
+            self.updated.emit(fields)
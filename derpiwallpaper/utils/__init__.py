@@ -1,18 +1,10 @@
-from datetime import datetime
 import os
 from pathlib import Path
 import platform
-from time import sleep
 import re
 
 import requests
 
-def wait_until(target_time: datetime):
-    now = datetime.now()
-    if target_time > now:
-        wait_seconds = (target_time - now).total_seconds()
-        sleep(wait_seconds)
-
 class DerpibooruApiError(RuntimeError):
     code: int
     body: str
@@ -22,6 +14,9 @@ class DerpibooruApiError(RuntimeError):
         self.body = body
         self.error = error
 
+class RequestCancelled(Exception):
+    """Raised by network I/O that was cancelled, e.g. because its worker is stopping."""
+
 def check_response(response: requests.Response):
     if response.status_code != 200:
         try:
@@ -0,0 +1,97 @@
+from __future__ import annotations
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlsplit
+import random
+
+import requests
+
+from derpiwallpaper.utils.metrics import get_metrics
+
+FAILURE_THRESHOLD = 5  # Consecutive failures after which an endpoint is considered down
+OPEN_SECONDS = 30.0  # Time requests to an endpoint that's down fail fast before a single trial request is let through
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of sending a request to an endpoint that failed repeatedly. Handled like any connection error."""
+    retry_after: float  # Seconds until the next trial request is let through
+
+    def __init__(self, host: str, retry_after: float) -> None:
+        super().__init__(f"{host} failed repeatedly, not retrying for {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker for a single endpoint.
+
+    After FAILURE_THRESHOLD consecutive failures the circuit opens and requests fail fast for OPEN_SECONDS. Afterwards
+    one trial request is let through (half-open), its success closes the circuit and its failure opens it again.
+    """
+    opened: int = 0  # Number of times the circuit opened
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self._lock = Lock()
+        self._failures = 0
+        self._open_until = 0.0
+
+    def before_request(self):
+        """Raises CircuitOpenError while the circuit is open, otherwise the request may be sent."""
+        with self._lock:
+            if self._failures < FAILURE_THRESHOLD:
+                return
+            now = monotonic()
+            if now < self._open_until:
+                raise CircuitOpenError(self.host, self._open_until - now)
+            # Half-open: let this request through and keep failing fast until it's done
+            self._open_until = now + OPEN_SECONDS
+
+    def on_success(self):
+        with self._lock:
+            self._failures = 0
+            self._open_until = 0.0
+
+    def on_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= FAILURE_THRESHOLD:
+                if self._failures == FAILURE_THRESHOLD:
+                    self.opened += 1
+                    get_metrics().circuit_breaker_opens.inc(host=self.host)
+                self._open_until = monotonic() + OPEN_SECONDS
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._failures >= FAILURE_THRESHOLD
+
+    def __str__(self) -> str:
+        return f"{self.host}: {'open' if self.is_open else 'closed'}, opened {self.opened} times"
+
+
+class CircuitBreakers:
+    """One circuit breaker per host, so an unreachable CDN doesn't stop searches and vice versa."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(host)
+            return self._breakers[host]
+
+    def __str__(self) -> str:
+        with self._lock:
+            return ", ".join(str(breaker) for breaker in self._breakers.values())
+
+
+def backoff_delay(failures: int, base: float, maximum: float) -> float:
+    """Returns a jittered exponential delay in seconds before retrying after a number of consecutive failures.
+
+    The delay doubles with every failure up to maximum, a random half of it is dropped so clients don't retry in sync.
+    """
+    delay = min(maximum, base * 2 ** max(0, failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from pathlib import Path
+from xml.etree import ElementTree
+import os
+
+from PySide6.QtCore import QByteArray
+from PySide6.QtDBus import QDBusConnection, QDBusInterface, QDBusMessage, QDBusPendingCall, QDBusVariant
+
+from derpiwallpaper.utils.set_wallpaper import WallpaperBackend, WallpaperSetError
+
+GNOME_BACKGROUND_KEYS = ("/org/gnome/desktop/background/picture-uri", "/org/gnome/desktop/background/picture-uri-dark")
+XFCE_IMAGE_PROPERTY_SUFFIXES = ("/last-image", "/image-path")
+XFCE_DEFAULT_IMAGE_PROPERTY = "/backdrop/screen0/monitor0/image-path"  # Used if xfdesktop hasn't stored any backdrop yet
+
+
+def _session_bus() -> QDBusConnection:
+    """Returns Qt's shared session bus connection, it stays open for the lifetime of the process."""
+    bus = QDBusConnection.sessionBus()
+    if not bus.isConnected():
+        raise WallpaperSetError(f"Unable to connect to the D-Bus session bus: {bus.lastError().message()}")
+    return bus
+
+
+def _is_service_available(bus: QDBusConnection, service: str) -> bool:
+    """Checks if a service is running or can be started by the bus on demand."""
+    bus_interface = bus.interface()
+    return bus_interface.isServiceRegistered(service).value() or service in bus_interface.activatableServiceNames()
+
+
+def _check_reply(reply: QDBusMessage) -> list:
+    if reply.type() == QDBusMessage.MessageType.ErrorMessage:
+        raise WallpaperSetError(f"{reply.errorName()}: {reply.errorMessage()}")
+    return reply.arguments()
+
+
+def _frame(body: bytes, ends: list[int]) -> bytes:
+    """Appends GVariant framing offsets, they use the smallest size that can address the whole container."""
+    size = 1
+    while len(body) + len(ends) * size >= 1 << (8 * size):
+        size *= 2
+    return body + b"".join(end.to_bytes(size, "little") for end in ends)
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+
+def serialise_dconf_changeset(values: dict[str, str]) -> bytes:
+    """Serialises string values into the GVariant "a{smv}" changeset expected by the dconf writer."""
+    body = b""
+    ends: list[int] = []
+    for key, value in values.items():
+        key_data = key.encode() + b"\0"
+        # Just(<value>): the variant holds the string, a separator and its type, the maybe adds a trailing zero byte
+        value_data = value.encode() + b"\0" + b"\0s" + b"\0"
+        body = _pad(body) + _frame(_pad(key_data) + value_data, [len(key_data)])
+        ends.append(len(body))
+    return _frame(body, ends)
+
+
+class GnomeDBusBackend(WallpaperBackend):
+    """Writes the GNOME background keys (light and dark) through the dconf writer service in a single change."""
+    name = "gnome (dbus)"
+    service = "ca.desrt.dconf"
+
+    def __init__(self, bus: QDBusConnection) -> None:
+        self._writer = QDBusInterface(self.service, "/ca/desrt/dconf/Writer/user", "ca.desrt.dconf.Writer", bus)
+
+    def apply(self, image_path: str | Path):
+        uri = Path(image_path).as_uri()
+        changeset = serialise_dconf_changeset({key: uri for key in GNOME_BACKGROUND_KEYS})
+        _check_reply(self._writer.call("Change", QByteArray(changeset)))
+
+
+class KdeDBusBackend(WallpaperBackend):
+    """Runs the Plasma desktop script over the session bus instead of spawning qdbus."""
+    name = "kde (dbus)"
+    service = "org.kde.plasmashell"
+
+    def __init__(self, bus: QDBusConnection) -> None:
+        self._shell = QDBusInterface(self.service, "/PlasmaShell", "org.kde.PlasmaShell", bus)
+
+    def apply(self, image_path: str | Path):
+        script = f'''
+        var allDesktops = desktops();
+        for (i=0; i<allDesktops.length; i++) {{
+            d = allDesktops[i];
+            d.wallpaperPlugin = "org.kde.image";
+            d.currentConfigGroup = Array("Wallpaper", "org.kde.image", "General");
+            d.writeConfig("Image", "file://{image_path}");
+        }}
+        '''
+        _check_reply(self._shell.call("evaluateScript", script))
+
+
+class XfceDBusBackend(WallpaperBackend):
+    """Sets the image of every XFCE monitor and workspace through xfconfd.
+
+    All properties are sent without waiting for the previous reply, so the whole batch costs a single round trip.
+    """
+    name = "xfce (dbus)"
+    service = "org.xfce.Xfconf"
+    channel = "xfce4-desktop"
+
+    def __init__(self, bus: QDBusConnection) -> None:
+        self._xfconf = QDBusInterface(self.service, "/org/xfce/Xfconf", "org.xfce.Xfconf", bus)
+        config_home = Path(os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config")
+        self._channel_file = config_home / "xfce4" / "xfconf" / "xfce-perchannel-xml" / f"{self.channel}.xml"
+
+    def _image_properties(self) -> list[str]:
+        """Lists the image properties of all monitors and workspaces xfdesktop has stored a backdrop for.
+
+        They are read from the channel file xfconfd persists, since PySide can't demarshal the a{sv} reply of GetAllProperties.
+        Monitors and workspaces can be added at any time, so the file is read again on every change.
+        """
+        try:
+            root = ElementTree.parse(self._channel_file).getroot()
+        except (OSError, ElementTree.ParseError):
+            return [XFCE_DEFAULT_IMAGE_PROPERTY]
+
+        properties = []
+        def collect(element: ElementTree.Element, base: str):
+            for child in element.findall("property"):
+                name = f"{base}/{child.get('name')}"
+                if name.endswith(XFCE_IMAGE_PROPERTY_SUFFIXES):
+                    properties.append(name)
+                collect(child, name)
+        collect(root, "")
+        return properties or [XFCE_DEFAULT_IMAGE_PROPERTY]
+
+    def apply(self, image_path: str | Path):
+        pending: list[QDBusPendingCall] = [
+            self._xfconf.asyncCallWithArgumentList("SetProperty", [self.channel, prop, QDBusVariant(str(image_path))])
+            for prop in self._image_properties()
+        ]
+        for call in pending:
+            call.waitForFinished()
+            if call.isError():
+                raise WallpaperSetError(f"{call.error().name()}: {call.error().message()}")
+
+
+_DBUS_BACKENDS: dict[str, type[GnomeDBusBackend | KdeDBusBackend | XfceDBusBackend]] = {
+    "gnome": GnomeDBusBackend,
+    "kde": KdeDBusBackend,
+    "xfce": XfceDBusBackend,
+}
+
+def resolve_dbus_backend(de: str) -> WallpaperBackend | None:
+    """Returns the native backend for a desktop environment, or None if its service isn't reachable on the session bus."""
+    backend_class = _DBUS_BACKENDS.get(de)
+    if not backend_class:
+        return None
+    try:
+        bus = _session_bus()
+    except WallpaperSetError as e:
+        print(f"Falling back to command line wallpaper tools. {e}")
+        return None
+    if not _is_service_available(bus, backend_class.service):
+        return None
+    return backend_class(bus)
@@ -0,0 +1,221 @@
+from __future__ import annotations
+from pathlib import Path
+from threading import Event, Lock
+from time import perf_counter
+from typing import Callable
+from urllib.parse import urlsplit
+import os
+import tempfile
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from derpiwallpaper.config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, RATE_LIMIT_RETRIES, get_conf
+from derpiwallpaper.utils import RequestCancelled
+from derpiwallpaper.utils.circuit_breaker import CircuitBreakers
+from derpiwallpaper.utils.http_cache import HttpCache
+from derpiwallpaper.utils.metrics import get_metrics
+from derpiwallpaper.utils.rate_limit import RateLimiter, parse_retry_after
+
+
+class ConnectionStats:
+    """Thread-safe counters for requests sent and connections opened by the shared client."""
+    requests: int = 0
+    connections_opened: int = 0
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    @property
+    def connections_reused(self) -> int:
+        """Number of requests that were served over an already open keep-alive connection."""
+        return max(0, self.requests - self.connections_opened)
+
+    def __str__(self) -> str:
+        return f"{self.requests} requests, {self.connections_opened} connections opened, {self.connections_reused} reused"
+
+
+def _counting_pool(pool_class: type[HTTPConnectionPool], stats: ConnectionStats) -> type[HTTPConnectionPool]:
+    """Returns a subclass of a urllib3 connection pool that counts newly opened connections."""
+    # urllib3 reconnects a dropped connection with the same connection object, so sockets are counted in connect()
+    class CountingConnection(pool_class.ConnectionCls):  # type: ignore[name-defined, misc]
+        def connect(self):
+            stats.count_connection()
+            return super().connect()
+
+    class CountingConnectionPool(pool_class):  # type: ignore[valid-type, misc]
+        ConnectionCls = CountingConnection
+    return CountingConnectionPool
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats: ConnectionStats, **kwargs) -> None:
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._stats),
+            "https": _counting_pool(HTTPSConnectionPool, self._stats),
+        }
+
+
+class HttpClient:
+    """Shared HTTP client that keeps connections to derpibooru.org and its CDN alive between requests.
+
+    All requests go through the process wide rate limiter, so the workers together stay within derpibooru's limits.
+    Hosts that fail repeatedly are skipped for a while by a circuit breaker per host.
+    """
+    stats: ConnectionStats
+    rate_limiter: RateLimiter
+    circuit_breakers: CircuitBreakers
+    cache: HttpCache | None
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, rate_limiter: RateLimiter, cache: HttpCache | None = None) -> None:
+        self.stats = ConnectionStats()
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.circuit_breakers = CircuitBreakers()
+        self._session = requests.Session()
+        adapter = _CountingHTTPAdapter(self.stats, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def get(self, url: str, cancel: Event | None = None, **kwargs) -> requests.Response:
+        """Sends a rate limited GET request. Requests answered with HTTP 429 are retried after the requested delay.
+
+        Connecting and every read are bounded by timeouts. Waits for the rate limiter end with RequestCancelled once
+        cancel is set. Raises CircuitOpenError without sending anything while the host is considered down.
+        API responses are served from the response cache while they're fresh and revalidated once they expired.
+        """
+        cache = self.cache if self.cache and not kwargs.get("stream") and self.rate_limiter.bucket_for(url) is self.rate_limiter.api else None
+        if not cache:
+            return self._send(url, cancel, **kwargs)
+
+        full_url = requests.Request("GET", url, params=kwargs.pop("params", None)).prepare().url or url
+        cached = cache.lookup(full_url)
+        if cached and cached.is_fresh():
+            cache.count("hit")
+            return cached.to_response()
+
+        kwargs["headers"] = (cached.validators() if cached else {}) | kwargs.get("headers", {})
+        response = self._send(full_url, cancel, **kwargs)
+        if cached and response.status_code == 304:
+            cache.count("revalidated")
+            return cache.refresh(cached, response).to_response()
+        cache.count("miss")
+        cache.store(full_url, response)
+        return response
+
+    def _send(self, url: str, cancel: Event | None = None, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        bucket = self.rate_limiter.bucket_for(url)
+        breaker = self.circuit_breakers.for_url(url)
+        attempt = 0
+        while True:
+            breaker.before_request()
+            bucket.acquire(cancel)
+            self.stats.count_request()
+            try:
+                response = self._session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                breaker.on_failure()
+                raise
+            # Server errors mean the host is unhealthy, any other answer proves it's up
+            if response.status_code >= 500:
+                breaker.on_failure()
+            else:
+                breaker.on_success()
+            if response.status_code != 429:
+                bucket.on_success()
+                return response
+
+            bucket.on_throttled(parse_retry_after(response.headers.get("Retry-After")))
+            if attempt >= RATE_LIMIT_RETRIES:
+                return response
+            print(f"Rate limited by {urlsplit(url).netloc}, retrying. Rate limits: {self.rate_limiter}")
+            response.close()
+            attempt += 1
+
+    def download(self, url: str, target: Path, on_progress: Callable[[int, int], None] | None = None, chunk_size: int = 64 * 1024,
+                 cancel: Event | None = None) -> Path:
+        """Streams a file to a temporary file next to the target and atomically renames it on success.
+
+        on_progress is called with the number of received bytes and the total size (0 if unknown) after each chunk.
+        Once cancel is set the download ends with RequestCancelled at the next chunk.
+        """
+        with self.get(url, cancel=cancel, stream=True) as response:
+            response.raise_for_status()
+            total = int(response.headers.get("Content-Length", 0) or 0)
+            received = 0
+            write_seconds = 0.0  # Only the time spent on disk, not waiting for the network
+
+            # The temp file is hidden and lacks the "derpibooru_" prefix so it's never picked up as a wallpaper
+            fd, temp_name = tempfile.mkstemp(dir=target.parent, prefix=".download_", suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if cancel and cancel.is_set():
+                            raise RequestCancelled()
+                        write_start = perf_counter()
+                        file.write(chunk)
+                        write_seconds += perf_counter() - write_start
+                        received += len(chunk)
+                        if on_progress:
+                            on_progress(received, total)
+                    write_start = perf_counter()
+                os.replace(temp_name, target)
+                get_metrics().disk_write_seconds.observe(write_seconds + perf_counter() - write_start)
+            except BaseException:
+                Path(temp_name).unlink(missing_ok=True)
+                raise
+        return target
+
+    def close(self):
+        self._session.close()
+        if self.cache:
+            self.cache.close()
+
+
+_HTTP: HttpClient | None = None
+_HTTP_LOCK = Lock()
+def get_http() -> HttpClient:
+    """Returns the global HTTP client and makes sure it's initialized."""
+
+    global _HTTP
+    with _HTTP_LOCK:
+        if not _HTTP:
+            conf = get_conf().snapshot()
+            _HTTP = HttpClient(
+                pool_connections=conf.http_pool_connections,
+                pool_maxsize=conf.http_pool_maxsize,
+                rate_limiter=RateLimiter(
+                    api_host=urlsplit(get_conf().derpibooru_json_api_url).netloc,
+                    api_rate=conf.api_rate_limit_per_second,
+                    api_burst=conf.api_rate_limit_burst,
+                    cdn_rate=conf.cdn_rate_limit_per_second,
+                    cdn_burst=conf.cdn_rate_limit_burst,
+                ),
+                cache=HttpCache(get_conf().appdir / "http_cache.sqlite3", conf.http_cache_size_mb * 1024 * 1024) if conf.http_cache_size_mb else None,
+            )
+    return _HTTP
+
+
+def close_http():
+    """Closes the global HTTP client and its cache, if it was initialized."""
+
+    global _HTTP
+    with _HTTP_LOCK:
+        if _HTTP:
+            _HTTP.close()
+            _HTTP = None
@@ -0,0 +1,182 @@
+from __future__ import annotations
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from derpiwallpaper.utils.metrics import get_metrics
+
+FALLBACK_TTL = 120.0  # Seconds a response without Cache-Control or Expires is fresh, mostly bounds how old a result total can get
+USED_AT_RESOLUTION = 60.0  # Seconds a response's last use may be outdated by, so not every hit costs a commit
+STORED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires")
+
+
+class CachedResponse(NamedTuple):
+    key: str
+    url: str
+    headers: dict[str, str]
+    body: bytes
+    expires_at: float  # time.time() after which the response has to be revalidated
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> dict[str, str]:
+        """Returns the headers of a conditional request that revalidates this response."""
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response.request = requests.Request("GET", self.url).prepare()
+        return response
+
+
+def freshness_lifetime(headers) -> float | None:
+    """Returns how many seconds a response may be served without revalidation, None if it must not be stored."""
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name.lower()] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    try:
+        age = float(headers.get("Age", 0))
+    except ValueError:
+        age = 0
+    if "max-age" in directives:
+        try:
+            return max(0, float(directives["max-age"]) - age)
+        except ValueError:
+            return 0
+    if "Expires" in headers:
+        try:
+            return max(0, parsedate_to_datetime(headers["Expires"]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            # Invalid dates mean the response is already expired
+            return 0
+    return FALLBACK_TTL
+
+
+class HttpCache:
+    """Size bounded on-disk cache of API responses that follows their Cache-Control and Expires headers.
+
+    Bodies are stored compressed. Expired responses are revalidated with If-None-Match/If-Modified-Since, so an unchanged
+    page only costs a 304 without a body. Responses without any caching headers are fresh for FALLBACK_TTL.
+    """
+    hits: int = 0  # Served from the cache without a request
+    revalidated: int = 0  # Served from the cache after a 304 response
+    misses: int = 0  # Fetched from scratch
+
+    def __init__(self, path: Path, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                );
+            """)
+
+    def _key(self, url: str) -> str:
+        # The URL contains the API key, so only its hash is stored
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def lookup(self, url: str) -> CachedResponse | None:
+        """Returns the stored response for a URL, fresh or not."""
+        key = self._key(url)
+        with self._lock:
+            row = self._db.execute("SELECT headers, body, expires_at, used_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            # Trimming only needs a rough LRU order
+            now = time.time()
+            if now - row[3] > USED_AT_RESOLUTION:
+                with self._db:
+                    self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        return CachedResponse(key, url, json.loads(row[0]), zlib.decompress(row[1]), row[2])
+
+    def store(self, url: str, response: requests.Response):
+        """Stores a successful response unless its headers forbid it, then trims the cache to max_bytes."""
+        lifetime = freshness_lifetime(response.headers)
+        if response.status_code != 200 or lifetime is None:
+            return
+        headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (self._key(url), json.dumps(headers), body, len(body), now + lifetime, now),
+            )
+            self._trim()
+
+    def refresh(self, cached: CachedResponse, not_modified: requests.Response) -> CachedResponse:
+        """Extends the lifetime of a stored response after the server confirmed it with a 304."""
+        headers = cached.headers | {name: not_modified.headers[name] for name in STORED_HEADERS if name in not_modified.headers}
+        lifetime = freshness_lifetime(headers | ({"Age": not_modified.headers["Age"]} if "Age" in not_modified.headers else {}))
+        cached = cached._replace(headers=headers, expires_at=time.time() + (lifetime or 0))
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE responses SET headers = ?, expires_at = ?, used_at = ? WHERE key = ?",
+                (json.dumps(headers), cached.expires_at, time.time(), cached.key),
+            )
+        return cached
+
+    def _trim(self):
+        """Drops the least recently used responses until the cache fits into max_bytes. Expects the lock to be held."""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used_at").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def count(self, result: str):
+        """Counts a lookup as "hit", "revalidated" or "miss"."""
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+        get_metrics().http_cache_lookups.inc(result=result)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / lookups if lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.revalidated} revalidated, {self.misses} misses ({self.hit_ratio:.0%} hit ratio)"
@@ -0,0 +1,193 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Iterator
+import bisect
+import json
+import math
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+SIZE_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(7))  # 64 KiB to 256 MiB
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if math.isinf(value) else repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed bucket bounds, exported like a Prometheus histogram."""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self._bounds = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = Lock()
+        self._counts = [0] * len(self._bounds)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._bounds, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observes the duration of the with block in seconds, also if it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self._bounds, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        return {
+            "type": "histogram",
+            "help": self.help,
+            "count": count,
+            "sum": total,
+            "buckets": {_format_value(bound): bucket_count for bound, bucket_count in zip(self._bounds, counts)},
+        }
+
+
+class Counter:
+    """Thread-safe counter with one value per combination of labels."""
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._lock = Lock()
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def to_prometheus(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in sorted(values.items()))
+        return lines
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+        return {
+            "type": "counter",
+            "help": self.help,
+            "values": [{"labels": dict(labels), "value": value} for labels, value in sorted(values.items())],
+        }
+
+
+class MetricsRegistry:
+    """Timings and counters of every stage of a wallpaper refresh, shared by all workers."""
+    search_request_seconds: Histogram
+    page_fetch_seconds: Histogram
+    image_download_seconds: Histogram
+    image_download_bytes: Histogram
+    disk_write_seconds: Histogram
+    set_wallpaper_seconds: Histogram
+    cleanup_seconds: Histogram
+    errors: Counter
+    rate_limit_waits: Counter
+    rate_limit_wait_seconds: Counter
+    rate_limited_responses: Counter
+    circuit_breaker_opens: Counter
+    http_cache_lookups: Counter
+
+    def __init__(self) -> None:
+        self.search_request_seconds = Histogram("derpiwallpaper_search_request_seconds", "Duration of search requests made to refresh the result count and search index.")
+        self.page_fetch_seconds = Histogram("derpiwallpaper_page_fetch_seconds", "Duration of fetching a random page of results to pick an image from.")
+        self.image_download_seconds = Histogram("derpiwallpaper_image_download_seconds", "Duration of image downloads, including writing them to disk.")
+        self.image_download_bytes = Histogram("derpiwallpaper_image_download_bytes", "Size of downloaded images.", SIZE_BUCKETS)
+        self.disk_write_seconds = Histogram("derpiwallpaper_disk_write_seconds", "Time spent writing a downloaded file to disk.")
+        self.set_wallpaper_seconds = Histogram("derpiwallpaper_set_wallpaper_seconds", "Duration of applying an image as desktop wallpaper.")
+        self.cleanup_seconds = Histogram("derpiwallpaper_cleanup_seconds", "Duration of the cleanup of old wallpapers.")
+        self.errors = Counter("derpiwallpaper_errors_total", "Errors by stage and exception type.")
+        self.rate_limit_waits = Counter("derpiwallpaper_rate_limit_waits_total", "Requests that had to wait for the rate limiter.")
+        self.rate_limit_wait_seconds = Counter("derpiwallpaper_rate_limit_wait_seconds_total", "Time requests spent waiting for the rate limiter.")
+        self.rate_limited_responses = Counter("derpiwallpaper_rate_limited_responses_total", "Responses with HTTP 429.")
+        self.circuit_breaker_opens = Counter("derpiwallpaper_circuit_breaker_opens_total", "Times requests to a host started failing fast after repeated failures.")
+        self.http_cache_lookups = Counter("derpiwallpaper_http_cache_lookups_total", "API requests by whether the response cache served them (hit), confirmed them with a 304 (revalidated) or missed.")
+
+    def count_error(self, stage: str, error: BaseException):
+        self.errors.inc(stage=stage, type=type(error).__name__)
+
+    def _metrics(self) -> list[Histogram | Counter]:
+        return [metric for metric in vars(self).values() if isinstance(metric, (Histogram, Counter))]
+
+    def to_prometheus(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        return "\n".join(line for metric in self._metrics() for line in metric.to_prometheus()) + "\n"
+
+    def to_json(self) -> str:
+        return json.dumps({metric.name: metric.to_dict() for metric in self._metrics()}, indent=2)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = get_metrics().to_prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body, content_type = get_metrics().to_json().encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serves the metrics on http://127.0.0.1:<port>/metrics (Prometheus) and /metrics.json until shut down.
+
+    Only binds to localhost, the metrics are meant to be scraped by a local agent.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://127.0.0.1:{server.server_port}/metrics")
+    return server
+
+
+_METRICS: MetricsRegistry | None = None
+_METRICS_LOCK = Lock()
+def get_metrics() -> MetricsRegistry:
+    """Returns the global metrics registry and makes sure it's initialized."""
+
+    global _METRICS
+    with _METRICS_LOCK:
+        if not _METRICS:
+            _METRICS = MetricsRegistry()
+    return _METRICS
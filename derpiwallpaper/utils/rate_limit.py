@@ -0,0 +1,110 @@
+from __future__ import annotations
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Event, Lock
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+
+from derpiwallpaper.utils import RequestCancelled
+from derpiwallpaper.utils.metrics import get_metrics
+
+RETRY_AFTER_DEFAULT = 5.0  # Pause in seconds after a 429 response without a usable Retry-After header
+RETRY_AFTER_MAX = 300.0  # Upper bound for pauses requested by the server
+MIN_RATE_FACTOR = 0.125  # Lowest fraction of the configured rate the bucket backs off to
+
+
+class TokenBucket:
+    """Thread-safe token bucket on the monotonic clock.
+
+    Tokens refill at `rate` per second up to `burst`. Every 429 response pauses the bucket and halves its rate, each
+    successful request afterwards raises it again by a tenth of the configured rate (AIMD).
+    """
+    throttled: int = 0  # Number of 429 responses seen
+    waited_seconds: float = 0  # Total time callers were blocked
+
+    def __init__(self, rate: float, burst: int, name: str = "") -> None:
+        self.name = name  # Label of the bucket in the metrics
+        self._lock = Lock()
+        self.configure(rate, burst)
+        self._tokens = float(self._burst)
+        self._updated = monotonic()
+        self._paused_until = 0.0
+
+    def configure(self, rate: float, burst: int):
+        with self._lock:
+            self._max_rate = max(rate, 0.001)
+            self._rate = self._max_rate
+            self._burst = max(burst, 1)
+
+    def _refill(self, now: float):
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self, cancel: Event | None = None):
+        """Blocks until a token is available and takes it. Raises RequestCancelled as soon as cancel is set."""
+        waited = False
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self._rate)
+                self.waited_seconds += wait
+            if not waited:
+                get_metrics().rate_limit_waits.inc(bucket=self.name)
+                waited = True
+            get_metrics().rate_limit_wait_seconds.inc(wait, bucket=self.name)
+            if cancel:
+                if cancel.wait(wait):
+                    raise RequestCancelled()
+            else:
+                sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._rate = min(self._max_rate, self._rate + self._max_rate / 10)
+
+    def on_throttled(self, retry_after: float):
+        """Pauses the bucket for retry_after seconds and backs off to a lower rate."""
+        with self._lock:
+            self.throttled += 1
+            get_metrics().rate_limited_responses.inc(bucket=self.name)
+            self._paused_until = max(self._paused_until, monotonic() + retry_after)
+            self._rate = max(self._max_rate * MIN_RATE_FACTOR, self._rate / 2)
+            self._tokens = 0
+
+    def __str__(self) -> str:
+        return f"{self._rate:.2f}/s, {self.throttled} throttled, waited {self.waited_seconds:.1f}s"
+
+
+def parse_retry_after(value: str | None) -> float:
+    """Returns the delay in seconds requested by a Retry-After header, which is either a number of seconds or an HTTP date."""
+    if not value:
+        return RETRY_AFTER_DEFAULT
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return RETRY_AFTER_DEFAULT
+    return min(max(delay, 0), RETRY_AFTER_MAX)
+
+
+class RateLimiter:
+    """Process wide rate limits with separate buckets for the derpibooru API and the image CDN."""
+    api: TokenBucket
+    cdn: TokenBucket
+
+    def __init__(self, api_host: str, api_rate: float, api_burst: int, cdn_rate: float, cdn_burst: int) -> None:
+        self.api_host = api_host
+        self.api = TokenBucket(api_rate, api_burst, name="api")
+        self.cdn = TokenBucket(cdn_rate, cdn_burst, name="cdn")
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        return self.api if urlsplit(url).netloc == self.api_host else self.cdn
+
+    def __str__(self) -> str:
+        return f"API: {self.api}, CDN: {self.cdn}"
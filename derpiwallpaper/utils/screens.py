@@ -0,0 +1,55 @@
+from __future__ import annotations
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PySide6.QtGui import QScreen
+
+_SCREEN_SIZE: tuple[int, int] | None = None
+_SCREEN_SIZE_LOCK = Lock()
+
+
+def _update_screen_size():
+    """Stores the size in physical pixels a wallpaper needs to fill every connected screen."""
+    from PySide6.QtGui import QGuiApplication
+
+    global _SCREEN_SIZE
+    screens: list[QScreen] = QGuiApplication.screens()
+    size = None
+    if screens:
+        size = (
+            max(round(screen.size().width() * screen.devicePixelRatio()) for screen in screens),
+            max(round(screen.size().height() * screen.devicePixelRatio()) for screen in screens),
+        )
+    with _SCREEN_SIZE_LOCK:
+        _SCREEN_SIZE = size
+
+
+def track_screens():
+    """Keeps the screen size current while screens are connected or changed. Must be called from the Qt main thread."""
+    # Qt is only imported with the GUI, headless the screens stay unknown
+    from PySide6.QtGui import QGuiApplication
+
+    app = QGuiApplication.instance()
+    if not isinstance(app, QGuiApplication):
+        # Without a GUI (e.g. in benchmarks) nothing is known about the screens
+        return
+
+    def watch(screen: QScreen):
+        screen.geometryChanged.connect(_update_screen_size)
+        screen.logicalDotsPerInchChanged.connect(_update_screen_size)
+
+    for screen in app.screens():
+        watch(screen)
+    app.screenAdded.connect(lambda screen: (watch(screen), _update_screen_size()))
+    app.screenRemoved.connect(lambda _: _update_screen_size())
+    _update_screen_size()
+
+
+def get_screen_size() -> tuple[int, int] | None:
+    """Returns the largest width and height in physical pixels across all screens, None if unknown.
+
+    Safe to call from worker threads, the value is only updated from the Qt main thread.
+    """
+    with _SCREEN_SIZE_LOCK:
+        return _SCREEN_SIZE
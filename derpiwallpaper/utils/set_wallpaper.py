@@ -2,11 +2,14 @@ import ctypes
 import os
 import platform
 import re
+import shutil
 import subprocess
 from pathlib import Path
+from threading import Lock
 
 from derpiwallpaper.config import get_conf
 from derpiwallpaper.utils import find_executables
+from derpiwallpaper.utils.metrics import get_metrics
 
 class WallpaperSetError(RuntimeError):
     pass
@@ -62,20 +65,26 @@ def _run_or_raise(cmd: list[str]):
         raise WallpaperSetError(result.stdout.strip())
     return result
 
-def set_wallpaper(image_path: str | Path):
-    """
-    Sets the desktop wallpaper across platforms.
+class WallpaperBackend:
+    """Sets the wallpaper for one platform or desktop environment, everything it needs is resolved once on creation."""
+    name: str = "unknown"
 
-    Args:
-        image_path (Path): The path to the image file.
-    """
-    system = platform.system()
+    def apply(self, image_path: str | Path):
+        raise NotImplementedError()
 
-    if system == "Windows":
+
+class WindowsBackend(WallpaperBackend):
+    name = "windows"
+
+    def apply(self, image_path: str | Path):
         # Windows: Use ctypes to set the wallpaper
         ctypes.windll.user32.SystemParametersInfoW(20, 0, str(image_path), 0x01 | 0x02)
 
-    elif system == "Darwin":  # macOS
+
+class MacBackend(WallpaperBackend):
+    name = "macos"
+
+    def apply(self, image_path: str | Path):
         # macOS: Use AppleScript to set the wallpaper
         script = f'''
         tell application "System Events"
@@ -89,39 +98,127 @@ def set_wallpaper(image_path: str | Path):
         '''
         subprocess.run(["osascript", "-e", script], check=True)
 
+
+class GnomeBackend(WallpaperBackend):
+    name = "gnome"
+
+    def __init__(self) -> None:
+        self.gsettings = shutil.which("gsettings") or "gsettings"
+
+    def apply(self, image_path: str | Path):
+        _run_or_raise([self.gsettings, "set", "org.gnome.desktop.background", "picture-uri", f"file://{image_path}"])
+
+
+class KdeBackend(WallpaperBackend):
+    name = "kde"
+
+    def __init__(self) -> None:
+        qdbus_pattern = re.compile(r"^qdbus(-qt)?\d*$")
+        qdbus_executable = next(find_executables(qdbus_pattern), None)
+        if not qdbus_executable:
+            raise WallpaperSetError("Failed to find qdbus executable to set KDE wallpaper.")
+        self.qdbus = str(qdbus_executable)
+
+    def apply(self, image_path: str | Path):
+        script = f'''
+        var allDesktops = desktops();
+        for (i=0; i<allDesktops.length; i++) {{
+            d = allDesktops[i];
+            d.wallpaperPlugin = "org.kde.image";
+            d.currentConfigGroup = Array("Wallpaper", "org.kde.image", "General");
+            d.writeConfig("Image", "file://{image_path}");
+        }}
+        '''
+
+        _run_or_raise([self.qdbus, "org.kde.plasmashell", "/PlasmaShell", "org.kde.PlasmaShell.evaluateScript", script])
+
+
+class XfceBackend(WallpaperBackend):
+    name = "xfce"
+
+    def __init__(self) -> None:
+        self.xfconf_query = shutil.which("xfconf-query") or "xfconf-query"
+
+    def apply(self, image_path: str | Path):
+        _run_or_raise([self.xfconf_query, "--channel", "xfce4-desktop", "--property", "/backdrop/screen0/monitor0/image-path", "--set", str(image_path)])
+
+
+_LINUX_BACKENDS: dict[str, type[WallpaperBackend]] = {
+    "gnome": GnomeBackend,
+    "kde": KdeBackend,
+    "xfce": XfceBackend,
+}
+
+def _resolve_backend() -> WallpaperBackend:
+    """Detects the platform and desktop environment and creates the matching backend."""
+    system = platform.system()
+
+    if system == "Windows":
+        return WindowsBackend()
+    elif system == "Darwin":  # macOS
+        return MacBackend()
     elif system == "Linux":
-        # Linux: Detect the active desktop environment and only run its code.
+        # Linux: Detect the active desktop environment and only use its backend.
         de = _detect_linux_desktop_env()
         if de is None:
             raise WallpaperSetError("Unable to detect Linux desktop environment (GNOME/KDE/XFCE).")
-
-        if de == "gnome":
-            _run_or_raise(["gsettings", "set", "org.gnome.desktop.background", "picture-uri", f"file://{image_path}"])
-
-        elif de == "kde":
-            qdbus_pattern = re.compile(r"^qdbus(-qt)?\d*$")
-            qdbus_executable = next(find_executables(qdbus_pattern), None)
-            if not qdbus_executable:
-                raise WallpaperSetError("Failed to find qdbus executable to set KDE wallpaper.")
-
-            script = f'''
-            var allDesktops = desktops();
-            for (i=0; i<allDesktops.length; i++) {{
-                d = allDesktops[i];
-                d.wallpaperPlugin = "org.kde.image";
-                d.currentConfigGroup = Array("Wallpaper", "org.kde.image", "General");
-                d.writeConfig("Image", "file://{image_path}");
-            }}
-            '''
-
-            _run_or_raise([str(qdbus_executable), "org.kde.plasmashell", "/PlasmaShell", "org.kde.PlasmaShell.evaluateScript", script])
-
-        elif de == "xfce":
-            _run_or_raise(["xfconf-query", "--channel", "xfce4-desktop", "--property", "/backdrop/screen0/monitor0/image-path", "--set", str(image_path)])
-        else:
+        if de not in _LINUX_BACKENDS:
             # Safety net, though we should only reach here for supported DEs.
             raise WallpaperSetError(f"Unsupported Linux desktop environment: {de}")
+
+        # Prefer talking to the desktop over the session bus, the command line tools are only a fallback
+        from derpiwallpaper.utils.dbus_wallpaper import resolve_dbus_backend
+        return resolve_dbus_backend(de) or _LINUX_BACKENDS[de]()
     else:
         raise WallpaperSetError("Unsupported operating system for setting wallpaper.")
 
+def _session_key() -> tuple:
+    """Identifies the desktop session, the cached backend is only valid as long as this stays the same."""
+    return (
+        platform.system(),
+        *(os.environ.get(var, "") for var in (
+            "XDG_CURRENT_DESKTOP",
+            "DESKTOP_SESSION",
+            "KDE_FULL_SESSION",
+            "GNOME_DESKTOP_SESSION_ID",
+            "DBUS_SESSION_BUS_ADDRESS",
+            "PATH",
+        )),
+    )
+
+_BACKEND: WallpaperBackend | None = None
+_BACKEND_SESSION: tuple | None = None
+_BACKEND_LOCK = Lock()
+def get_wallpaper_backend() -> WallpaperBackend:
+    """Returns the cached wallpaper backend, it's resolved again when the session changed or after a failed set."""
+
+    global _BACKEND, _BACKEND_SESSION
+    with _BACKEND_LOCK:
+        session = _session_key()
+        if not _BACKEND or session != _BACKEND_SESSION:
+            _BACKEND = _resolve_backend()
+            _BACKEND_SESSION = session
+        return _BACKEND
+
+def invalidate_wallpaper_backend():
+    global _BACKEND
+    with _BACKEND_LOCK:
+        _BACKEND = None
+
+def set_wallpaper(image_path: str | Path):
+    """
+    Sets the desktop wallpaper across platforms.
+
+    Args:
+        image_path (Path): The path to the image file.
+    """
+    try:
+        with get_metrics().set_wallpaper_seconds.time():
+            get_wallpaper_backend().apply(image_path)
+    except Exception as e:
+        get_metrics().count_error("set_wallpaper", e)
+        # The desktop may have changed (e.g. a different session or a removed executable), detect it again next time
+        invalidate_wallpaper_backend()
+        raise
+
     get_conf().current_wallpaper_path = str(image_path)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Iterable
+import os
+
+from derpiwallpaper.config import get_conf
+
+WALLPAPER_PREFIX = "derpibooru_"
+
+
+class WallpaperIndex:
+    """In-memory index of the wallpapers managed in the wallpaper folder, ordered from oldest to newest.
+
+    The folder is only scanned completely on startup or when it's changed. Afterwards the index is kept current from
+    our own downloads and a names-only sync after the folder was changed externally, so no file has to be stat()ed again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._files: OrderedDict[str, Path] = OrderedDict()
+        self._folder: Path | None = None
+
+    def rescan(self, folder: Path):
+        """Rebuilds the index from a full scan of the folder, ordered by modification time."""
+        entries: list[tuple[float, Path]] = []
+        if folder.is_dir():
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.startswith(WALLPAPER_PREFIX) and entry.is_file():
+                        entries.append((entry.stat().st_mtime, Path(entry.path)))
+        entries.sort(key=lambda e: e[0])
+
+        with self._lock:
+            self._folder = folder
+            self._files = OrderedDict((path.name, path) for _, path in entries)
+
+    def sync(self):
+        """Picks up files that were added or removed by someone else, only the names in the folder are read."""
+        if not self._folder:
+            return
+        try:
+            with os.scandir(self._folder) as it:
+                names = {entry.name for entry in it if entry.name.startswith(WALLPAPER_PREFIX)}
+        except FileNotFoundError:
+            names = set()
+
+        with self._lock:
+            for name in [name for name in self._files if name not in names]:
+                del self._files[name]
+            for name in sorted(names - self._files.keys()):
+                self._files[name] = self._folder / name
+
+    def add(self, path: Path):
+        """Marks a wallpaper as the newest one, e.g. because it was just downloaded."""
+        with self._lock:
+            self._files[path.name] = path
+            self._files.move_to_end(path.name)
+
+    def paths(self) -> list[Path]:
+        """Returns all indexed wallpapers, newest first."""
+        with self._lock:
+            return list(reversed(self._files.values()))
+
+    def get(self, name: str) -> Path | None:
+        """Returns the path of an indexed wallpaper by its file name."""
+        with self._lock:
+            return self._files.get(name)
+
+    def discard(self, path: Path):
+        with self._lock:
+            self._files.pop(path.name, None)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def pop_oldest(self, keep: int, skip: Iterable[Path] = ()) -> list[Path]:
+        """Removes and returns the oldest wallpapers so that only the newest ones are kept. Paths in skip are neither removed nor counted."""
+        skip_names = {path.name for path in skip}
+        removed: list[Path] = []
+        with self._lock:
+            excess = len(self._files) - len(skip_names & self._files.keys()) - keep
+            for name, path in self._files.items():
+                if len(removed) >= excess:
+                    break
+                if name not in skip_names:
+                    removed.append(path)
+            for path in removed:
+                del self._files[path.name]
+        return removed
+
+
+_WALLPAPER_INDEX: WallpaperIndex | None = None
+_WALLPAPER_INDEX_LOCK = Lock()
+def get_wallpaper_index() -> WallpaperIndex:
+    """Returns the global wallpaper index and makes sure it's initialized."""
+
+    global _WALLPAPER_INDEX
+    with _WALLPAPER_INDEX_LOCK:
+        if not _WALLPAPER_INDEX:
+            _WALLPAPER_INDEX = WallpaperIndex()
+            _WALLPAPER_INDEX.rescan(get_conf().snapshot().wallpaper_folder)
+    return _WALLPAPER_INDEX
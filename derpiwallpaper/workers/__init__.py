@@ -1,40 +1,112 @@
 from __future__ import annotations
 
-from PySide6.QtCore import QThread, Signal, SignalInstance, QObject
-
-
-
 def wman() -> WorkerManager:
     assert _WMAN, 'Worker manager must be running when calling wman()'
     return _WMAN
 
-from time import sleep
+from datetime import datetime
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Any, Callable
+
+from derpiwallpaper.config import SHUTDOWN_TIMEOUT, WALL_CLOCK_RECHECK_SECONDS, get_conf
+from derpiwallpaper.utils import RequestCancelled
+from derpiwallpaper.workers.scheduler import ScheduledCall, Scheduler
+
+class UiUpdates:
+    """Receives the parts of the UI that became outdated. Without a GUI (e.g. in headless mode) nothing is redrawn."""
+
+    def mark_dirty(self, *fields: str):
+        pass
+
 
-class WorkerThread(QThread):
-    update_ui: SignalInstance = Signal()  # type: ignore # Signal to notify about updates
-    on_error: SignalInstance = Signal(Exception)  # type: ignore # Signal to notify about errors
+class WorkerThread(Thread):
+    """Plain daemon thread that runs on_tick whenever it's woken up, it doesn't depend on Qt so it also runs headless."""
+    wakeups: int = 0  # Number of ticks performed, useful for measuring idle overhead
+
+    _wakeup: Event
+    _stopping: Event
+    _scheduled_wakeup: ScheduledCall | None = None
+    _remove_config_listeners: list[Callable[[], None]]
 
     def __init__(self) -> None:
-        super().__init__()
+        super().__init__(name=type(self).__name__, daemon=True)
+        self._wakeup = Event()
+        self._stopping = Event()
+        self._remove_config_listeners = []
 
     def on_tick(self):
-        """Perform work in each tick."""
+        """Perform work in each tick. Ticks only happen after wake() or a deadline set with wake_at()."""
         pass
 
+    def notify_ui(self, *fields: str):
+        """Marks parts of the UI as outdated, they are redrawn with the next frame."""
+        wman().ui_updates.mark_dirty(*fields)
+
+    def wake(self):
+        """Run a tick as soon as possible, e.g. because the config changed."""
+        self._wakeup.set()
+
+    def wake_at(self, deadline: float | None):
+        """Run a tick at a time.monotonic() deadline, replacing the previously set deadline. None clears it."""
+        if self._scheduled_wakeup:
+            self._scheduled_wakeup.cancel()
+            self._scheduled_wakeup = None
+        if deadline is not None:
+            self._scheduled_wakeup = wman().scheduler.call_at(deadline, self.wake)
+
+    def wake_at_time(self, when: datetime | None):
+        """Run a tick at a wall-clock time, replacing the previously set deadline. None clears it.
+
+        The monotonic clock stops while the system is suspended, so the worker wakes up at least every
+        WALL_CLOCK_RECHECK_SECONDS and on_tick has to check the wall clock and call this again.
+        """
+        if when is None:
+            self.wake_at(None)
+            return
+        remaining = max(0, (when - datetime.now()).total_seconds())
+        self.wake_at(monotonic() + min(remaining, WALL_CLOCK_RECHECK_SECONDS))
+
+    def watch_config(self, *keys: str, callback: Callable[[Any], None] | None = None):
+        """Calls callback with the new value whenever one of the config keys changes, by default the worker is just woken up."""
+        for key in keys:
+            self._remove_config_listeners.append(get_conf().on_change(key, callback or (lambda _: self.wake())))
+
     def run(self) -> None:
         """Run the worker thread."""
-        while not self.isInterruptionRequested():
+        # Always run an initial tick so workers can set up their schedule
+        self.wake()
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            self.wakeups += 1
             try:
                 self.on_tick()
+            except RequestCancelled:
+                # Network I/O was cancelled because the worker is stopping
+                break
             except Exception as e:
-                self.on_error.emit(e)
+                if self._stopping.is_set():
+                    # The worker was abandoned while stopping, the app is already shutting down
+                    break
+                wman().report_error(e)
                 raise e
-            sleep(0.1)
 
-    def stop(self):
-        """Stop the worker thread."""
-        self.requestInterruption()  # Request the thread to stop
-        self.wait()  # Optionally wait for the thread to finish
+    def request_stop(self):
+        """Asks the worker to stop after the current tick, pending network I/O is cancelled."""
+        self._stopping.set()
+        while self._remove_config_listeners:
+            self._remove_config_listeners.pop()()
+        self.wake_at(None)
+        self.wake()
+
+    def stop(self, timeout: float | None = None) -> bool:
+        """Stops the worker thread and waits up to timeout seconds for the current tick to finish. Returns if it stopped."""
+        self.request_stop()
+        self.join(timeout)
+        return not self.is_alive()
 
 from derpiwallpaper.workers.search import SearchWorker
 from derpiwallpaper.workers.wallpaper_updater import WallpaperUpdaterWorker
@@ -42,34 +114,59 @@ from derpiwallpaper.workers.cleanup import WallpaperCleanupWorker
 
 _WMAN: WorkerManager | None = None
 
-class WorkerManager(QObject):
+class WorkerManager:
+    scheduler: Scheduler
+    ui_updates: UiUpdates
     wp_updater: WallpaperUpdaterWorker
     search: SearchWorker
-    on_error: SignalInstance = Signal(Exception) # type: ignore
+    cleanup: WallpaperCleanupWorker
 
-    def __init__(self) -> None:
-        super().__init__()
+    _error_listeners: list[Callable[[Exception], None]]
+    _error_listeners_lock: Lock
 
+    def __init__(self, ui_updates: UiUpdates | None = None) -> None:
         global _WMAN
         assert not _WMAN, 'Only one worker manager can cun at a time.'
         _WMAN = self
 
+        self._error_listeners = []
+        self._error_listeners_lock = Lock()
+        self.scheduler = Scheduler()
+        self.ui_updates = ui_updates or UiUpdates()
         self.search = SearchWorker()
-        self.search.on_error.connect(self.on_error.emit)
         self.wp_updater = WallpaperUpdaterWorker()
-        self.wp_updater.on_error.connect(self.on_error.emit)
         self.cleanup = WallpaperCleanupWorker()
-        self.cleanup.on_error.connect(self.on_error.emit)
 
         self.search.start()
         self.wp_updater.start()
         self.cleanup.start()
 
-    def stop(self):
+    def on_error(self, listener: Callable[[Exception], None]):
+        """Calls listener with every exception that stopped a worker. It runs on the worker's thread."""
+        with self._error_listeners_lock:
+            self._error_listeners.append(listener)
+
+    def report_error(self, error: Exception):
+        with self._error_listeners_lock:
+            listeners = list(self._error_listeners)
+        for listener in listeners:
+            listener(error)
+
+    def stop(self, timeout: float = SHUTDOWN_TIMEOUT):
+        """Stops all workers within timeout seconds in total.
+
+        A worker that's still blocked afterwards (e.g. reading from a stalled connection until the read timeout) is
+        abandoned, it's a daemon thread and doesn't keep the process alive.
+        """
         global _WMAN
 
-        self.cleanup.stop()
-        self.wp_updater.stop()
-        self.search.stop()
+        deadline = monotonic() + timeout
+        workers: list[WorkerThread] = [self.cleanup, self.wp_updater, self.search]
+        for worker in workers:
+            worker.request_stop()
+        for worker in workers:
+            if not worker.stop(max(0, deadline - monotonic())):
+                print(f"{worker.name} didn't stop within {timeout}s, abandoning it.")
+        self.scheduler.stop(max(0, deadline - monotonic()))
 
         _WMAN = None # type: ignore
@@ -1,35 +1,72 @@
 from  __future__ import annotations
-from datetime import datetime, timedelta
+from pathlib import Path
+from time import monotonic
 
 from derpiwallpaper.config import CLEANUP_INTERVAL, get_conf
-from derpiwallpaper.workers import WorkerThread
+from derpiwallpaper.utils.metrics import get_metrics
+from derpiwallpaper.wallpaper_index import get_wallpaper_index
+from derpiwallpaper.workers import WorkerThread, wman
 
 class WallpaperCleanupWorker(WorkerThread):
 
-    _next_cleanup_time: datetime | None = None
+    _next_cleanup_time: float | None = None  # time.monotonic() deadline
+    _folder_mtime: int | None = None  # Modification time of the wallpaper folder when the index was last synced
+    _rescan_needed: bool = False  # The wallpaper folder setting changed, the index has to be rebuilt
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._folder_mtime = self._get_folder_mtime(get_conf().wallpaper_folder)
+        self.watch_config("wallpapers_to_keep", callback=lambda _: self.schedule_cleanup())
+        self.watch_config("wallpaper_folder", callback=self._on_wallpaper_folder_setting_changed)
 
     def on_tick(self) -> None:
         # Schedule cleanup
-        if not self._next_cleanup_time or (self._next_cleanup_time - datetime.now()).total_seconds() > CLEANUP_INTERVAL:
-            self.schedule_cleanup()
+        if not self._next_cleanup_time:
+            self._next_cleanup_time = monotonic() + CLEANUP_INTERVAL
+
+        if monotonic() >= self._next_cleanup_time:
+            with get_metrics().cleanup_seconds.time():
+                self._perform_cleanup()
+            self._next_cleanup_time = monotonic() + CLEANUP_INTERVAL
 
-        if self._next_cleanup_time and datetime.now() >= self._next_cleanup_time:
-            self._perform_cleanup()
+        self.wake_at(self._next_cleanup_time)
 
     def schedule_cleanup(self):
-        self._next_cleanup_time = datetime.now() + timedelta(seconds=CLEANUP_INTERVAL)
+        """(Re)schedules the cleanup to run CLEANUP_INTERVAL seconds from now."""
+        self._next_cleanup_time = None
+        self.wake()
 
-    def _perform_cleanup(self):
-        # Scan folder for "derpibooru_" prefixed files
-        files = [f for f in get_conf().wallpaper_folder.glob("derpibooru_*") if f.is_file()]
+    def _get_folder_mtime(self, folder: Path) -> int | None:
+        """The folder's modification time changes whenever a file is added, removed or renamed in it."""
+        try:
+            return folder.stat().st_mtime_ns
+        except OSError:
+            return None
 
-        # Sort files by modification time (most recent last)
-        files.sort(key=lambda f: f.stat().st_mtime)
+    def _on_wallpaper_folder_setting_changed(self, folder: Path):
+        self._rescan_needed = True
+        self.schedule_cleanup()
+
+    def _perform_cleanup(self):
+        conf = get_conf().snapshot()
+        index = get_wallpaper_index()
 
-        # Check if we have more files than we want to keep
-        if len(files) > get_conf().wallpapers_to_keep:
-            files_to_delete = files[:-get_conf().wallpapers_to_keep]  # All but the most recent ones
+        # Bring the index up to date, a full scan is only needed when the folder itself changed. Otherwise a single stat
+        # tells if files were added or removed by someone else since the last cleanup.
+        folder_mtime = self._get_folder_mtime(conf.wallpaper_folder)
+        if self._rescan_needed:
+            self._rescan_needed = False
+            index.rescan(conf.wallpaper_folder)
+            self.notify_ui("gallery")
+        elif folder_mtime != self._folder_mtime:
+            index.sync()
+            self.notify_ui("gallery")
+        self._folder_mtime = folder_mtime
 
-            for file in files_to_delete:
-                file.unlink(missing_ok=True)  # Delete file
-            print(f'Cleaned up {len(files_to_delete)} old wallpapers.')
\ No newline at end of file
+        # Remove all but the most recent wallpapers, skipping images that are queued to be applied
+        files_to_delete = index.pop_oldest(conf.wallpapers_to_keep, skip=wman().wp_updater.get_prefetched_paths())
+        for file in files_to_delete:
+            file.unlink(missing_ok=True)  # Delete file
+        if files_to_delete:
+            print(f'Cleaned up {len(files_to_delete)} old wallpapers.')
+            self.notify_ui("gallery")
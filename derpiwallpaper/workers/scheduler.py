@@ -0,0 +1,78 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable
+import heapq
+
+
+@dataclass(order=True)
+class ScheduledCall:
+    deadline: float
+    seq: int
+    callback: Callable[[], None] = field(compare=False)
+    cancelled: bool = field(default=False, compare=False)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """Runs callbacks when their deadline on the monotonic clock is due.
+
+    A single thread sleeps until the earliest deadline in a timer heap, so idle workers cause no wakeups at all.
+    Callbacks run on the scheduler thread and should only hand work off (e.g. wake a worker).
+    """
+    wakeups: int = 0  # Number of times the scheduler thread woke up, useful for measuring idle overhead
+
+    def __init__(self) -> None:
+        self._heap: list[ScheduledCall] = []
+        self._seq = 0
+        self._condition = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="DerpiWallpaperScheduler", daemon=True)
+        self._thread.start()
+
+    def call_at(self, deadline: float, callback: Callable[[], None]) -> ScheduledCall:
+        """Schedules a callback at a time.monotonic() deadline."""
+        with self._condition:
+            self._seq += 1
+            call = ScheduledCall(deadline, self._seq, callback)
+            heapq.heappush(self._heap, call)
+            # Only interrupt the sleep if the new call is due before everything else
+            if self._heap[0] is call:
+                self._condition.notify()
+            return call
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> ScheduledCall:
+        return self.call_at(monotonic() + delay, callback)
+
+    def stop(self, timeout: float | None = None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            due: list[ScheduledCall] = []
+            with self._condition:
+                # Drop cancelled calls so they don't cause pointless wakeups
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+
+                if self._stopped:
+                    return
+                timeout = self._heap[0].deadline - monotonic() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                self.wakeups += 1
+
+                now = monotonic()
+                while self._heap and self._heap[0].deadline <= now:
+                    call = heapq.heappop(self._heap)
+                    if not call.cancelled:
+                        due.append(call)
+
+            for call in due:
+                call.callback()
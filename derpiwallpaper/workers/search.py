@@ -1,74 +1,215 @@
 from  __future__ import annotations
-from threading import Thread
+from collections import OrderedDict
+from threading import Event
 from urllib.parse import urlsplit
 import requests
 import ctypes
 import random
 import math
 import os
-from datetime import datetime, timedelta
-from PySide6.QtCore import QObject, QThread, Signal, SignalInstance
-
-from derpiwallpaper.config import get_conf
-from derpiwallpaper.utils import DerpibooruApiError, check_response, wait_until
-from derpiwallpaper.workers import WorkerThread
+from time import monotonic
+
+from derpiwallpaper.config import PAGE_SIZE, get_conf
+from derpiwallpaper.utils import DerpibooruApiError, RequestCancelled, check_response
+from derpiwallpaper.utils.circuit_breaker import CircuitOpenError, backoff_delay
+from derpiwallpaper.utils.http import get_http
+from derpiwallpaper.utils.metrics import get_metrics
+from derpiwallpaper.search_index import get_index
+from derpiwallpaper.workers import WorkerThread, wman
+
+INDEX_SYNC_MAX_PAGES = 5  # Maximum number of delta pages fetched per sync to stay within rate limits
+RETRY_BASE_SECONDS = 2.0  # Delay before retrying a search after the first transient error, doubles with every further error
+RETRY_MAX_SECONDS = 300.0  # Upper bound for the delay between retries
+RECENT_TOTALS_SIZE = 32  # Number of recent search strings whose result count is reused without searching again
+RECENT_TOTALS_MAX_AGE = 300.0  # Seconds a remembered result count is reused
 
 class SearchWorker(WorkerThread):
 
     _images_url: str
-    _current_search_string: str | None = None
+    _current_search_string: str | None = None  # Last search string a search was attempted for
+    _failures: int = 0  # Consecutive transient errors of the current search string
+    _retry_at: float | None = None  # time.monotonic() deadline of the next retry, None if there's nothing to retry
+    _stale: Event  # Set when the search string changes, cancels the search that's running for the old one
+    _recent_totals: OrderedDict[str, tuple[int, float]]  # LRU of search string -> (total, time.monotonic() of the search)
     current_result_count: int = 0
     current_page_count: int = 0
     temporary_error: str | None = None
-    _last_request_time: datetime | None = None
+    ready: Event  # Set once a result count is known, from the search index or the first search
 
     def __init__(self) -> None:
         self._images_url = get_conf().derpibooru_json_api_url + "search/images"
+        self._stale = Event()
+        self._recent_totals = OrderedDict()
+        self.ready = Event()
         super().__init__()
+        self.watch_config("search_string", callback=lambda _: self._on_search_string_changed())
 
-    def on_tick(self) -> None:
-        if get_conf().search_string != self._current_search_string or self.temporary_error:
-            self._refresh_results()
-
-    def _refresh_results(self) -> None:
-        if self._last_request_time:
-            # Wait until 1s after the last request to avoid hitting rate limits
-            wait_until(self._last_request_time+timedelta(seconds=1))
-
-        try:
-            # Set API parameters
-            params = {
-                "key": get_conf().derpibooru_json_api_key,  # If you have an API key, insert it here; otherwise, it will use the public anon key
-                "q": get_conf().search_string,
-                "per_page": 1  # Maximum number of results to fetch (max allowed by the API for anon keys is 50)
-            }
-
-            # Fetch JSON data from Derpibooru for the first page to determine total pages
-            response = requests.get(self._images_url, params=params)
-            self._last_request_time = datetime.now()
-            self._current_search_string = params["q"]
+        # Start with the last known result count, the live count is fetched in the background
+        cached_total = get_index().get_total(get_conf().search_string)
+        if cached_total is not None:
+            self._set_result_count(cached_total)
+            self.ready.set()
 
-            # Check if the request was successful and parse json
-            check_response(response)
+    def _on_search_string_changed(self):
+        self._stale.set()
+        self.wake()
 
+    def request_stop(self):
+        self._stale.set()
+        super().request_stop()
 
-            json_data = response.json()
+    def on_tick(self) -> None:
+        # Cleared before reading the search string, so a change from here on cancels the search for it
+        self._stale.clear()
+        search_string = get_conf().snapshot().search_string
+        if search_string != self._current_search_string:
+            self._failures = 0
+            self._retry_at = None
+            if not self._use_recent_total(search_string):
+                self._refresh_results(search_string)
+        elif self._retry_at is not None and monotonic() >= self._retry_at:
+            self._refresh_results(search_string)
+
+        # Retry transient errors with backoff, otherwise sleep until the search string changes
+        self.wake_at(self._retry_at)
+
+    def _refresh_results(self, search_string: str) -> None:
+        previous_state = self._result_state()
+        self._current_search_string = search_string
+        try:
+            # Fetch the newest page of results, it contains the total and the first part of the index delta
+            json_data = self._fetch_page(search_string, page=1)
 
             # Update results & pages
-            self.current_result_count = json_data['total']
-            self.current_page_count = math.ceil(json_data['total'] / params["per_page"])
+            self._set_result_count(json_data['total'])
             self.temporary_error = None
-
+            self._failures = 0
+            self._retry_at = None
+            self._remember_total(search_string, json_data['total'])
+
+            get_index().set_total(search_string, json_data['total'])
+            self._sync_index(search_string, json_data['images'])
+
+        except RequestCancelled:
+            if self._stopping.is_set():
+                raise
+            # The search string changed meanwhile, the next tick searches for the new one (even if it was changed back)
+            self._current_search_string = None
+            return
         except DerpibooruApiError as e:
-            self.temporary_error = f'Invalid search string: {e.error}'
-        except requests.ConnectionError as e:
+            get_metrics().count_error("search", e)
+            if e.code == 429 or e.code >= 500 or e.code == 200:
+                # Derpibooru is overloaded or answered garbage, the same search may succeed later
+                self.temporary_error = f'Derpibooru API Error: {e.error}'
+                self._schedule_retry()
+            else:
+                # Derpibooru rejected the search, retrying is pointless until the search string changes
+                self.temporary_error = f'Invalid search string: {e.error}'
+                self._retry_at = None
+        except (requests.ConnectionError, requests.Timeout) as e:
+            get_metrics().count_error("search", e)
             self.temporary_error = f"Unable to connect to {urlsplit(self._images_url).netloc}."
+            self._schedule_retry(e.retry_after if isinstance(e, CircuitOpenError) else 0)
+
+            # Keep serving wallpapers from the local search index while offline
+            cached_total = get_index().get_total(search_string)
+            if cached_total is not None and not self.current_result_count:
+                self._set_result_count(cached_total)
+
+        self._publish_results(previous_state)
+
+    def _use_recent_total(self, search_string: str) -> bool:
+        """Shows the result count of a recent search for the same string without searching again. Returns if there was one."""
+        recent = self._recent_totals.get(search_string)
+        if not recent or monotonic() - recent[1] > RECENT_TOTALS_MAX_AGE:
+            return False
+        previous_state = self._result_state()
+        self._recent_totals.move_to_end(search_string)
+        self._current_search_string = search_string
+        self._set_result_count(recent[0])
+        self.temporary_error = None
+        self._publish_results(previous_state)
+        return True
+
+    def _remember_total(self, search_string: str, total: int):
+        self._recent_totals[search_string] = (total, monotonic())
+        self._recent_totals.move_to_end(search_string)
+        while len(self._recent_totals) > RECENT_TOTALS_SIZE:
+            self._recent_totals.popitem(last=False)
+
+    def _result_state(self) -> tuple:
+        return (self.temporary_error, self.current_result_count, self.ready.is_set())
+
+    def _publish_results(self, previous_state: tuple):
+        """Marks the result count as known and tells the UI and the updater about it if anything changed."""
+        self.ready.set()
+        # Failed retries usually change nothing, only redraw and wake the updater if something did
+        if self._result_state() != previous_state:
+            self.notify_ui("search")
+            # New results allow the updater to continue prefetching
+            wman().wp_updater.wake()
+
+    def _schedule_retry(self, min_delay: float = 0):
+        """Schedules a retry of the current search with jittered exponential backoff."""
+        self._failures += 1
+        delay = max(min_delay, backoff_delay(self._failures, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
+        self._retry_at = monotonic() + delay
+        print(f"Search failed, retrying in {delay:.1f}s ({self._failures} consecutive errors).")
+
+    def _set_result_count(self, total: int):
+        self.current_result_count = total
+        self.current_page_count = math.ceil(total / PAGE_SIZE)
+
+    def _fetch_page(self, q: str, page: int, oldest_first: bool = False) -> dict:
+        """Fetches a page of results for a search string, sorted by id with the newest images first by default."""
+        # Set API parameters
+        params = {
+            "key": get_conf().derpibooru_json_api_key,  # If you have an API key, insert it here; otherwise, it will use the public anon key
+            "q": q,
+            "per_page": PAGE_SIZE,
+            "page": page,
+            "sf": "id",
+            "sd": "asc" if oldest_first else "desc",
+        }
+
+        with get_metrics().search_request_seconds.time():
+            response = get_http().get(self._images_url, cancel=self._stale, params=params)
+            if self._stale.is_set():
+                # The search string changed while waiting for the response, only the latest search may update the results
+                raise RequestCancelled()
 
-        finally:
-            self.update_ui.emit()
-
-    def start(self) -> None:
-        super().start()
-        self._refresh_results()  # Ensure initial refresh happens before other threads start
-
-
+            # Check if the request was successful and parse json
+            check_response(response)
+            return response.json()
+
+    def _sync_index(self, search_string: str, newest_images: list[dict]):
+        """Adds all images newer than the last synced id to the search index."""
+        index = get_index()
+        synced_max_id = index.get_synced_max_id(search_string)
+        index.add_images(search_string, newest_images)
+        if not newest_images:
+            return
+        newest_id = newest_images[0]['id']
+
+        # Without a previous sync the newest page seeds the index, older images are added as the updater fetches them.
+        # Otherwise the newest page covers the delta if it reaches back to the synced id or holds all results.
+        if synced_max_id is not None and len(newest_images) == PAGE_SIZE:
+            oldest_new_id = min(image['id'] for image in newest_images)
+            # Page through the gap oldest first and advance the synced id after every page, so an incomplete sync
+            # continues where it stopped instead of fetching the same pages again
+            pages = 1
+            while synced_max_id + 1 < oldest_new_id:
+                if pages >= INDEX_SYNC_MAX_PAGES:
+                    print(f"Search index for '{search_string}' is synced up to id {synced_max_id} of {newest_id}, continuing with the next sync.")
+                    return
+                images = self._fetch_page(f"({search_string}), id.gt:{synced_max_id}", page=1, oldest_first=True)['images']
+                pages += 1
+                index.add_images(search_string, images)
+                if not images:
+                    break
+                synced_max_id = max(image['id'] for image in images)
+                index.set_synced_max_id(search_string, synced_max_id)
+                if len(images) < PAGE_SIZE:
+                    break
+
+        index.set_synced_max_id(search_string, newest_id)
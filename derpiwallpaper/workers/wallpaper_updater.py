@@ -1,109 +1,346 @@
 from  __future__ import annotations
+from collections import deque
+from pathlib import Path, PurePosixPath
 from urllib.parse import urlsplit
 import requests
 import random
 from datetime import datetime, timedelta
+import hashlib
+import os
 
-from derpiwallpaper.config import get_conf
+from derpiwallpaper.config import PAGE_SIZE, get_conf
+from derpiwallpaper.search_index import get_index
 from derpiwallpaper.utils import DerpibooruApiError, check_response, get_user_images_folder
+from derpiwallpaper.utils.http import get_http
+from derpiwallpaper.utils.metrics import get_metrics
+from derpiwallpaper.utils.screens import get_screen_size
 from derpiwallpaper.utils.set_wallpaper import set_wallpaper
+from derpiwallpaper.wallpaper_index import get_wallpaper_index
 from derpiwallpaper.workers import WorkerThread, wman
 
+# Bounding boxes derpibooru scales its representations into, the aspect ratio is kept and images are never upscaled
+REPRESENTATION_SIZES = {
+    "medium": (800, 600),
+    "large": (1280, 1024),
+    "tall": (1024, 4096),
+}
+
+
+def select_representation(image: dict, screen_size: tuple[int, int] | None) -> tuple[str | None, str]:
+    """Returns the name and URL of the smallest representation of an image that still fills the screen.
+
+    The name is None if only the original does.
+    """
+    representations: dict[str, str] = image.get("representations") or {}
+    width, height = image.get("width"), image.get("height")
+    if not screen_size or not width or not height:
+        return None, image["view_url"]
+
+    best: tuple[float, str] | None = None
+    for name, (box_width, box_height) in REPRESENTATION_SIZES.items():
+        if name not in representations:
+            continue
+        scale = min(1, box_width / width, box_height / height)
+        if width * scale >= screen_size[0] and height * scale >= screen_size[1]:
+            pixels = width * scale * height * scale
+            if not best or pixels < best[0]:
+                best = (pixels, name)
+    return (best[1], representations[best[1]]) if best else (None, image["view_url"])
+
 
 class WallpaperUpdaterWorker(WorkerThread):
-    progress = 4
-    max_steps = 4
+    refreshing: bool = False
+    progress: int = 0  # Downloaded bytes of the current image
+    max_steps: int = 0  # Size of the current image in bytes, 0 if unknown
     temporary_error: str | None = None
+    cache_hits: int = 0  # Images that were already on disk and didn't have to be downloaded
+    cache_misses: int = 0
 
     _images_url: str
     _next_refresh_time: datetime | None = None
+    _prefetched: deque[Path]
+    _prefetch_downloads: set[Path]  # Queued files the prefetch downloaded itself, only these may be deleted with the queue
+    _prefetch_search_string: str | None = None
+    _prefetch_failed: bool = False
+    _candidates: list[dict]  # Unused image records from the last fetched page
+    _requested_wallpaper: Path | None = None  # Local file the user picked to be applied
 
     def __init__(self):
         self._images_url = get_conf().derpibooru_json_api_url + "search/images"
+        self._prefetched = deque()
+        self._prefetch_downloads = set()
+        self._candidates = []
         super().__init__()
+        self.watch_config("search_string", "prefetch_depth", "auto_refresh_interval_seconds")
+        self.watch_config("enable_auto_refresh", callback=lambda _: self.clear_refresh())
 
-    def set_progress(self, progress: int):
+    def set_progress(self, progress: int, max_steps: int):
+        # Only notify the UI about whole percent steps to avoid flooding it with a signal per chunk
+        notify = (
+            max_steps != self.max_steps
+            or not max_steps
+            or progress * 100 // max_steps != self.progress * 100 // max_steps
+        )
         self.progress = progress
-        self.update_ui.emit()
+        self.max_steps = max_steps
+        if notify:
+            self.notify_ui("progress")
+
+    def set_refreshing(self, refreshing: bool):
+        self.refreshing = refreshing
+        self.progress = self.max_steps = 0
+        self.notify_ui("refresh", "progress")
 
     def on_tick(self) -> None:
+        # Nothing can be picked before the result count is known, the search worker wakes us once it is
+        if not wman().search.ready.is_set():
+            return
+
+        conf = get_conf().snapshot()
+
+        # Drop prefetched images and candidates that no longer match the search string
+        if conf.search_string != self._prefetch_search_string:
+            self.invalidate_prefetch()
+            self._candidates.clear()
+            self._prefetch_search_string = conf.search_string
+
         # Schedule refresh if auto-refresh is enabled and no refresh is scheduled in the configured interval
-        if get_conf().enable_auto_refresh == True:
-            if not self._next_refresh_time or (self._next_refresh_time - datetime.now()).total_seconds() > get_conf().auto_refresh_interval_seconds:
-                self.schedule_refresh(datetime.now() + timedelta(seconds=get_conf().auto_refresh_interval_seconds))
+        if conf.enable_auto_refresh == True:
+            if not self._next_refresh_time or (self._next_refresh_time - datetime.now()).total_seconds() > conf.auto_refresh_interval_seconds:
+                self.schedule_refresh(datetime.now() + timedelta(seconds=conf.auto_refresh_interval_seconds))
 
-        if self._next_refresh_time and datetime.now() >= self._next_refresh_time:
+        if self._requested_wallpaper:
+            self._apply_requested_wallpaper()
+        elif self._next_refresh_time and datetime.now() >= self._next_refresh_time:
             self._refresh_wallpaper()
+        elif len(self._prefetched) < conf.prefetch_depth and not self._prefetch_failed and wman().search.current_page_count:
+            # Top up the prefetch queue one image per tick so scheduled refreshes are not delayed
+            self._prefetch_image()
+            self.wake()
+
+        # Sleep until the next refresh is due, after a suspend it runs at most WALL_CLOCK_RECHECK_SECONDS late
+        self.wake_at_time(self._next_refresh_time)
 
     def schedule_refresh(self, time: datetime | None, update_ui = True):
         self._next_refresh_time = time
+        self.wake()
         if update_ui:
-            self.update_ui.emit()
+            self.notify_ui("refresh")
 
     def clear_refresh(self, update_ui = True):
         self._next_refresh_time = None
+        self.wake()
         if update_ui:
-            self.update_ui.emit()
+            self.notify_ui("refresh")
 
 
+    def apply_wallpaper(self, image_path: Path):
+        """Applies a wallpaper that's already on disk, e.g. one picked in the gallery."""
+        self._requested_wallpaper = image_path
+        self.wake()
+
+    def _apply_requested_wallpaper(self):
+        image_path, self._requested_wallpaper = self._requested_wallpaper, None
+        if not image_path:
+            return
+        try:
+            set_wallpaper(image_path)
+            # Keep the picked wallpaper from being cleaned up soon
+            os.utime(image_path)
+            get_wallpaper_index().add(image_path)
+            self.temporary_error = None
+            print(f'Wallpaper set to "{image_path}".')
+        except FileNotFoundError:
+            get_wallpaper_index().discard(image_path)
+            self.temporary_error = f"{image_path.name} doesn't exist anymore."
+        self.notify_ui("wallpaper", "refresh", "gallery")
+
     def get_next_refresh_time(self):
         return self._next_refresh_time
 
-    def _refresh_wallpaper(self) -> None:
-        if not wman().search.current_page_count:
-            self.temporary_error = "No images found!"
-            self.update_ui.emit()
+    def get_prefetched_paths(self) -> list[Path]:
+        """Returns the downloaded images that are waiting to be applied."""
+        return list(self._prefetched)
+
+    def invalidate_prefetch(self):
+        """Drops all prefetched images and deletes the ones the prefetch downloaded, e.g. because they don't match the search string anymore."""
+        while self._prefetched:
+            image_path = self._prefetched.popleft()
+            # Files that were already on disk (e.g. the current or a kept wallpaper) stay where they are
+            if image_path in self._prefetch_downloads:
+                self._prefetch_downloads.discard(image_path)
+                image_path.unlink(missing_ok=True)
+                get_wallpaper_index().discard(image_path)
+        self._prefetch_failed = False
+
+    def _pop_prefetched(self) -> Path | None:
+        """Returns the next prefetched image that is still intact on disk."""
+        while self._prefetched:
+            image_path = self._prefetched.popleft()
+            self._prefetch_downloads.discard(image_path)
+            if image_path.is_file() and image_path.stat().st_size > 0:
+                return image_path
+        return None
+
+    def _prefetch_image(self):
+        try:
+            image_path, downloaded = self._download_random_image()
+        except (DerpibooruApiError, requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            get_metrics().count_error("prefetch", e)
+            # Retry after the next refresh instead of hammering the API in the background
+            self._prefetch_failed = True
+            print(f"Failed to prefetch wallpaper: {e}")
             return
+
+        # Never queue the current wallpaper or an image twice. Drawing one again hints at a small result set, so
+        # try again after the next refresh
+        if image_path in self._prefetched or str(image_path) == get_conf().current_wallpaper_path:
+            self._prefetch_failed = True
+            return
+        self._prefetched.append(image_path)
+        if downloaded:
+            self._prefetch_downloads.add(image_path)
+
+    def _pick_random_image(self) -> dict:
+        """Returns a random image record matching the search string.
+
+        Records are drawn from the candidate pool of the last fetched page first, a new page is only fetched once the pool is empty.
+        """
+        if self._candidates:
+            return self._candidates.pop(random.randrange(len(self._candidates)))
+
+        # Map a uniformly random result index to its page and the offset within that page
+        index = random.randrange(max(1, wman().search.current_result_count))
+        page, offset = divmod(index, PAGE_SIZE)
+
+        # Set API parameters
+        params = {
+            "key": get_conf().derpibooru_json_api_key,  # If you have an API key, insert it here; otherwise, it will use the public anon key
+            "q": get_conf().search_string,
+            "per_page": PAGE_SIZE,
+            "page": page + 1
+        }
+
+        # Fetch JSON data for the random page, fall back to the local search index while derpibooru is unreachable
         try:
-            START_TIME = datetime.now()
-            self.set_progress(0)
+            with get_metrics().page_fetch_seconds.time():
+                response = get_http().get(self._images_url, cancel=self._stopping, params=params)
+        except (requests.ConnectionError, requests.Timeout):
+            indexed_image = get_index().random_image(params["q"])
+            if not indexed_image:
+                raise
+            print("Derpibooru is unreachable, using an image from the local search index.")
+            return indexed_image
+
+        # Proceed with the rest of the script for the random page's images
+        check_response(response)
+        images: list[dict] = response.json()['images']
+        get_index().add_images(params["q"], images)
 
-            # Set API parameters
-            params = {
-                "key": get_conf().derpibooru_json_api_key,  # If you have an API key, insert it here; otherwise, it will use the public anon key
-                "q": get_conf().search_string,
-                "per_page": 1,  # Maximum number of results to fetch (max allowed by the API for anon keys is 50)
-                "page": random.randint(1, max(1, wman().search.current_page_count))
-            }
+        # Check if there are any images in the response
+        if len(images) == 0:
+            raise DerpibooruApiError(response.status_code, response.text, "No images found!")
 
-            # Fetch JSON data for the random page
-            response = requests.get(self._images_url, params=params)
-            self.set_progress(2)
+        # The result set may have shrunk since the total was fetched, fall back to a random record of the page
+        if offset >= len(images):
+            offset = random.randrange(len(images))
 
-            # Proceed with the rest of the script for the random page's images
-            check_response(response)
-            json_data = response.json()
+        random_image = images.pop(offset)
+        self._candidates = images
+        return random_image
 
-            # Check if there are any images in the response
-            if len(json_data['images']) > 0:
-                # Select a random image from the response
-                random_image = random.choice(json_data['images'])
+    def _download_random_image(self, report_progress = False) -> tuple[Path, bool]:
+        """Downloads a random image matching the search string. Returns its path and if it was downloaded, not reused."""
+        random_image = self._pick_random_image()
 
-                if "view_url" not in random_image:
-                    raise RuntimeError(f'Invalid response JSON after fetching images page: image item missing key "view_url". Response body: {response.text}')
+        if "view_url" not in random_image:
+            raise RuntimeError(f'Invalid image record: missing key "view_url". Record: {random_image}')
 
-                # Construct the direct image URL
-                image_url = random_image['view_url']
+        # Pick the smallest version of the image that fills the screens and keep its real file extension
+        representation, image_url = select_representation(random_image, get_screen_size())
+        extension = PurePosixPath(urlsplit(image_url).path).suffix or f".{random_image.get('format', 'png')}"
 
-                # Download the image
-                image_path = get_conf().wallpaper_folder / f"derpibooru_{random_image['id']}.png"
-                with open(image_path, 'wb') as file:
-                    file.write(requests.get(image_url).content)
-                    self.set_progress(3)
+        # Reuse the image if the same representation was downloaded before, touching it keeps it from being cleaned up.
+        # Representations are named after their size, so a smaller one is never reused once the screen grew.
+        suffix = f"_{representation}" if representation else ""
+        image_path = get_conf().wallpaper_folder / f"derpibooru_{random_image['id']}{suffix}{extension.lower()}"
+        cached_path = get_wallpaper_index().get(image_path.name)
+        if cached_path and self._is_intact(cached_path, random_image, is_original=representation is None):
+            os.utime(cached_path)
+            get_wallpaper_index().add(cached_path)
+            self.cache_hits += 1
+            return cached_path, False
+        self.cache_misses += 1
 
+        # Stream the image to disk, it only shows up under its final name once it's complete
+        with get_metrics().image_download_seconds.time():
+            get_http().download(image_url, image_path, on_progress=self.set_progress if report_progress else None, cancel=self._stopping)
+        get_metrics().image_download_bytes.observe(image_path.stat().st_size)
+        get_wallpaper_index().add(image_path)
+        return image_path, True
 
-                # Set the downloaded image as the desktop wallpaper (Windows only)
-                set_wallpaper(image_path)
+    def _is_intact(self, path: Path, image: dict, is_original: bool) -> bool:
+        """Checks a downloaded image against the hashes of the API record.
+
+        Only originals can be verified since derpibooru publishes no hashes for the scaled representations.
+        """
+        try:
+            if path.stat().st_size == 0:
+                return False
+            if not is_original:
+                return True
+            expected = {image.get("sha512_hash"), image.get("orig_sha512_hash")} - {None}
+            if not expected:
+                return True
+            with open(path, "rb") as file:
+                return hashlib.file_digest(file, "sha512").hexdigest() in expected
+        except FileNotFoundError:
+            return False
 
-                self.temporary_error = None
-                print(f"Wallpaper set successfully to a random image matching '{get_conf().search_string}' from page {params["page"]}/{wman().search.current_page_count}. Runtime: {round((datetime.now()-START_TIME).total_seconds(),1)}s")
+    def _refresh_wallpaper(self) -> None:
+        if not wman().search.current_page_count:
+            self.temporary_error = "No images found!"
+            # Move the due refresh on, otherwise the past refresh time wakes the worker again right away
+            self._schedule_next_refresh()
+            return
+        try:
+            START_TIME = datetime.now()
+            self.set_refreshing(True)
+
+            # Use a prefetched image if available, otherwise download one while the user waits
+            image_path = self._pop_prefetched()
+            source = "prefetch queue"
+            if not image_path:
+                image_path, _ = self._download_random_image(report_progress=True)
+                source = "derpibooru"
+
+            # Set the downloaded image as the desktop wallpaper
+            set_wallpaper(image_path)
+            self.notify_ui("wallpaper", "gallery")
+
+            self.temporary_error = None
+            print(f"Wallpaper set successfully to a random image matching '{get_conf().search_string}' from {source}. Runtime: {round((datetime.now()-START_TIME).total_seconds(),3)}s. HTTP: {get_http().stats}. Response cache: {get_http().cache or 'disabled'}. Image cache: {self.cache_hits} hits, {self.cache_misses} misses")
         except DerpibooruApiError as e:
+            get_metrics().count_error("refresh", e)
             self.temporary_error = f'Derpibooru API Error: {e.error}'
+        except requests.Timeout as e:
+            get_metrics().count_error("refresh", e)
+            self.temporary_error = f"{urlsplit(self._images_url).netloc} didn't respond in time."
         except requests.ConnectionError as e:
+            get_metrics().count_error("refresh", e)
             self.temporary_error = f"Unable to connect to {urlsplit(self._images_url).netloc}."
+        except requests.HTTPError as e:
+            get_metrics().count_error("refresh", e)
+            self.temporary_error = f"Failed to download image: {e}"
         finally:
-            self.set_progress(4)
-            if get_conf().enable_auto_refresh:
-                self.schedule_refresh(datetime.now() + timedelta(seconds=get_conf().auto_refresh_interval_seconds))
-            else:
-                self.schedule_refresh(None)
+            # Allow the background prefetch to retry after failures
+            self._prefetch_failed = False
+            self.set_refreshing(False)
+            self._schedule_next_refresh()
+
+    def _schedule_next_refresh(self):
+        """Schedules the next auto refresh one interval from now, or none if auto refresh is disabled."""
+        if get_conf().enable_auto_refresh:
+            self.schedule_refresh(datetime.now() + timedelta(seconds=get_conf().auto_refresh_interval_seconds))
+        else:
+            self.schedule_refresh(None)